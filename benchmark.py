@@ -0,0 +1,878 @@
+"""
+Сквозной бенчмарк бота против локального фейкового Telegram Bot API.
+
+Скрипт поднимает aiohttp-сервер, который отвечает на методы Bot API вместо
+настоящего Telegram, направляет на него бота из main.py и прогоняет полные
+сценарии (каталог, карточка сыра, оформление заказа с самовывозом и доставкой,
+добавление/редактирование/удаление сыра администратором) от имени тысяч
+виртуальных пользователей.
+
+Отчет: пропускная способность, перцентили задержки по хэндлерам, время в БД
+и число вызовов API на сценарий. Результаты дописываются в JSONL-файл вместе с
+версией кода, а отчет сравнивается с предыдущим запуском.
+
+С --shops N поднимается N магазинов со своими ботами и базами на одном
+диспетчере, а покупатели распределяются между ними по кругу.
+
+В конце main.py запускается отдельным процессом с настоящим опросом getUpdates
+(--cold-start-orders): замеряется время от старта процесса до первого ответа
+и плавная остановка по SIGTERM с апдейтами в обработке.
+
+Пример:
+    python benchmark.py --users 2000 --concurrency 200 --shops 3
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import suppress
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+BENCH_BOT_ID = 123456
+BENCH_ADMIN_ID = 500000
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Текущий сценарий и хэндлер, в контексте которых идут запросы к БД и API
+current_flow = contextvars.ContextVar('current_flow', default=None)
+current_handler = contextvars.ContextVar('current_handler', default=None)
+
+
+class FlowStats:
+    """Накопитель метрик одного прогона."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)  # хэндлер -> [мс]
+        self.flow_runs = Counter()
+        self.flow_db_time = defaultdict(float)  # сценарий -> сек в БД
+        self.flow_db_queries = Counter()
+        self.flow_api_calls = defaultdict(Counter)  # сценарий -> метод -> число вызовов
+        self.unhandled = 0
+        self.errors = Counter()
+        self.log_calls = 0
+        self.log_time = 0.0  # сек, потраченные на вызовы logger.* (включенных уровней)
+
+    def add_db_time(self, elapsed):
+        flow = current_flow.get()
+        if flow:
+            self.flow_db_time[flow] += elapsed
+            self.flow_db_queries[flow] += 1
+
+
+stats = FlowStats()
+
+
+# Фейковый Bot API
+class FakeBotAPI:
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self.updates = []  # очередь апдейтов для getUpdates
+        self.confirmed_offset = 0  # наибольшее смещение, подтвержденное ботом
+        self.fetched_update_id = 0  # последний апдейт, отданный боту
+        self.replies = []  # (время, chat_id) отправленных ботом сообщений
+        self.delay = 0.0  # задержка ответа на отправку сообщений, сек
+        self._message_id = 0
+        self._runner = None
+        self._new_updates = asyncio.Event()
+        self._new_reply = asyncio.Event()
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._new_updates.set()  # Отпускаем висящие long polling запросы
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _message(self, chat_id, text=None):
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if text is not None:
+            message['text'] = text
+        return message
+
+    def push_update(self, update):
+        self.updates.append(update)
+        self._new_updates.set()
+
+    async def wait_replies(self, count, timeout):
+        async def wait():
+            while len(self.replies) < count:
+                self._new_reply.clear()
+                await self._new_reply.wait()
+        await asyncio.wait_for(wait(), timeout=timeout)
+
+    async def get_updates(self, data):
+        offset = int(data.get('offset') or 0)
+        self.confirmed_offset = max(self.confirmed_offset, offset)
+        self.updates = [update for update in self.updates if update['update_id'] >= self.confirmed_offset]
+        timeout = float(data.get('timeout') or 0)
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._new_updates.wait(), timeout=timeout)
+        result = self.updates[:int(data.get('limit') or 100)]
+        if result:
+            self.fetched_update_id = max(self.fetched_update_id, result[-1]['update_id'])
+        return result
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        data = await request.post()
+        chat_id = int(data.get('chat_id', 0) or 0)
+
+        if method == 'getUpdates':
+            result = await self.get_updates(data)
+        elif method == 'getMe':
+            result = {'id': int(request.match_info['token'].split(':')[0]), 'is_bot': True, 'first_name': 'Benchmark', 'username': 'bench_bot'}
+        elif method in ('sendMessage', 'sendPhoto', 'editMessageReplyMarkup', 'editMessageText'):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            result = self._message(chat_id, data.get('text'))
+            if method in ('sendMessage', 'sendPhoto'):
+                self.replies.append((time.perf_counter(), chat_id))
+                self._new_reply.set()
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+def make_session_class():
+    from aiogram.client.session.aiohttp import AiohttpSession
+
+    class CountingSession(AiohttpSession):
+        """Сессия, считающая вызовы API в разрезе сценариев."""
+
+        async def make_request(self, bot, method, timeout=None):
+            flow = current_flow.get()
+            if flow:
+                stats.flow_api_calls[flow][method.__api_method__] += 1
+            return await super().make_request(bot, method, timeout=timeout)
+
+    return CountingSession
+
+
+# Построение входящих апдейтов
+class UpdateFactory:
+    def __init__(self):
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def _user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    def message(self, user_id, text=None, photo=None):
+        update_id, message_id = self._next()
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                command = text.split()[0]
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        if photo is not None:
+            message['photo'] = [{'file_id': photo, 'file_unique_id': photo, 'width': 800, 'height': 600}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user_id, data):
+        update_id, message_id = self._next()
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': '...',
+                },
+            },
+        }
+
+
+class Driver:
+    """Прогоняет сценарии через dp.feed_update, замеряя каждый апдейт."""
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.bot = tenant.bot
+        self.updates = UpdateFactory()
+        self.total_updates = 0
+
+    async def feed(self, raw_update):
+        from aiogram.types import Update
+
+        update = Update.model_validate(raw_update, context={'bot': self.bot})
+        holder = {}
+        token = current_handler.set(holder)
+        started = time.perf_counter()
+        try:
+            await self.tenant.main.dp.feed_update(self.bot, update)
+        except Exception as e:
+            stats.errors[type(e).__name__] += 1
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            current_handler.reset(token)
+        self.total_updates += 1
+        handler = holder.get('name')
+        if handler is None:
+            stats.unhandled += 1
+            handler = 'UNHANDLED'
+        stats.latencies[handler].append(elapsed)
+
+    async def text(self, user_id, text):
+        await self.feed(self.updates.message(user_id, text=text))
+
+    async def photo(self, user_id, file_id):
+        await self.feed(self.updates.message(user_id, photo=file_id))
+
+    async def press(self, user_id, data):
+        await self.feed(self.updates.callback(user_id, data))
+
+    async def run_flow(self, name, coro):
+        token = current_flow.set(name)
+        try:
+            await coro
+            stats.flow_runs[name] += 1
+        finally:
+            current_flow.reset(token)
+
+    # Сценарии покупателя
+    async def browse_catalog(self, user_id):
+        await self.text(user_id, '/start')
+        await self.text(user_id, 'Каталог')
+        await self.press(user_id, 'catalog_next_0')
+        await self.press(user_id, 'catalog_prev_1')
+        await self.press(user_id, 'popular_0')
+
+    async def view_cheese(self, user_id, cheese_id):
+        await self.press(user_id, f'cheese_{cheese_id}')
+        await self.press(user_id, 'back_to_catalog')
+
+    async def checkout(self, user_id, cheese_id, delivery):
+        await self.press(user_id, f'order_{cheese_id}')
+        await self.text(user_id, f'Покупатель {user_id}')
+        await self.text(user_id, f'+94 77 {user_id:07d}')
+        await self.text(user_id, str(random.randrange(100, 2001, 100)))
+        if delivery:
+            await self.press(user_id, 'delivery')
+            await self.text(user_id, f'Коломбо, ул. Сырная, {user_id % 300 + 1}')
+        else:
+            await self.press(user_id, 'pickup')
+
+    async def customer(self, user_id, cheese_ids):
+        await self.run_flow('browse_catalog', self.browse_catalog(user_id))
+        await self.run_flow('view_cheese', self.view_cheese(user_id, random.choice(cheese_ids)))
+        delivery = random.random() < 0.5
+        flow = 'checkout_delivery' if delivery else 'checkout_pickup'
+        await self.run_flow(flow, self.checkout(user_id, random.choice(cheese_ids), delivery))
+        await self.run_flow('order_history', self.order_history(user_id))
+
+    async def order_history(self, user_id):
+        await self.text(user_id, 'Мои заказы')
+
+    # Сценарии администратора
+    async def admin_add(self, admin_id, n):
+        await self.text(admin_id, '/add_cheese')
+        await self.text(admin_id, f'Бенчмарк {n}')
+        await self.text(admin_id, 'Сыр, добавленный бенчмарком')
+        await self.text(admin_id, '1250')
+        await self.photo(admin_id, f'bench-photo-{n}')
+
+    async def admin_edit(self, admin_id, cheese_id, n):
+        await self.text(admin_id, f'/edit_cheese Бенчмарк {n}')
+        await self.press(admin_id, 'editpage_0')
+        await self.press(admin_id, f'edit_cheese_{cheese_id}')
+        await self.press(admin_id, f'edit_field_price_{cheese_id}')
+        await self.text(admin_id, '1400')
+        await self.press(admin_id, f'edit_field_name_{cheese_id}')
+        await self.text(admin_id, f'Изменённый {n}')
+
+    async def admin_adjust_prices(self, admin_id):
+        await self.text(admin_id, '/adjust_prices +10 сыр 1')
+
+    async def admin_delete(self, admin_id, cheese_id):
+        await self.text(admin_id, 'Удалить сыр')
+        await self.press(admin_id, f'delete_cheese_{cheese_id}')
+        await self.press(admin_id, 'confirm_delete')
+
+    async def admin_order_status(self, admin_id, order_id):
+        await self.press(admin_id, f'ostatus_confirmed_{order_id}')
+        await self.press(admin_id, f'ostatus_delivered_{order_id}')
+
+    async def admin_view_orders(self, admin_id, order_id):
+        await self.text(admin_id, 'Просмотреть заказы')
+        await self.press(admin_id, f'allorders_{order_id}')
+
+    async def admin(self, admin_id, iterations):
+        for n in range(iterations):
+            order_id = self.tenant.latest_order_id()
+            if order_id:
+                await self.run_flow('admin_order_status', self.admin_order_status(admin_id, order_id))
+                await self.run_flow('admin_view_orders', self.admin_view_orders(admin_id, order_id))
+            await self.run_flow('admin_add', self.admin_add(admin_id, n))
+            cheese_id = self.tenant.latest_cheese_id()
+            await self.run_flow('admin_edit', self.admin_edit(admin_id, cheese_id, n))
+            await self.run_flow('admin_adjust_prices', self.admin_adjust_prices(admin_id))
+            await self.run_flow('admin_delete', self.admin_delete(admin_id, cheese_id))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def import_main(workdir, log_level):
+    """Импортирует main.py так, чтобы база, резервные копии и лог лежали во временном каталоге."""
+    # База и резервные копии бенчмарка никогда не должны попадать в рабочие файлы магазина
+    os.environ['DB_PATH'] = os.path.join(workdir, 'cheese_shop.db')
+    os.environ['BACKUP_DIR'] = os.path.join(workdir, 'backups')
+    os.environ['LOG_FILE'] = os.path.join(workdir, 'bot.log')
+    os.environ['LOG_LEVEL'] = log_level
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+
+    # Время запросов к БД дополнительно раскладываем по сценариям
+    record_db_time = main.record_db_time
+
+    def timed(elapsed):
+        record_db_time(elapsed)
+        stats.add_db_time(elapsed)
+
+    main.record_db_time = timed
+    instrument_logging()
+    return main
+
+
+def instrument_logging():
+    """Замеряет время всех вызовов логгеров включенных уровней: это их цена для цикла событий."""
+    log = logging.Logger._log
+
+    def timed_log(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return log(self, *args, **kwargs)
+        finally:
+            stats.log_time += time.perf_counter() - started
+            stats.log_calls += 1
+
+    logging.Logger._log = timed_log
+
+
+def logging_benchmark(main, workdir, count=2000):
+    """Цена одной записи для вызывающего: очередь main.py против синхронной записи JSON в файл."""
+    queued = logging.getLogger('bench.queued')
+    direct = logging.getLogger('bench.direct')
+    direct.propagate = False
+    file_handler = logging.FileHandler(os.path.join(workdir, 'direct.log'), encoding='utf-8')
+    file_handler.setFormatter(main.JsonFormatter())
+    direct.addHandler(file_handler)
+
+    def per_record(logger, burst=10):
+        # Пишем пачками с паузами, как хэндлеры между ожиданиями сети: в паузах поток
+        # вывода успевает разобрать очередь. Время пауз не учитывается
+        token = main.log_context.set({'update_id': 1, 'user_id': 1, 'handler': 'bench'})
+        elapsed = 0.0
+        for start in range(0, count, burst):
+            time.sleep(0.002)
+            started = time.perf_counter()
+            for i in range(start, start + burst):
+                logger.warning("Пользователь %s ввел телефон: %s", i, main.Redacted(f'+94 77 {i:07d}'))
+            elapsed += time.perf_counter() - started
+        main.log_context.reset(token)
+        return round(elapsed * 1e6 / count, 2)
+
+    result = {'queued_us_per_record': per_record(queued), 'direct_us_per_record': per_record(direct)}
+    file_handler.close()
+    return result
+
+
+class Tenant:
+    """Магазин из main.py со своим ботом и базой во временном каталоге."""
+
+    def __init__(self, main, workdir, number, session, order_handlers=0):
+        self.main = main
+        self.admin_id = BENCH_ADMIN_ID + number
+        self.shop = main.register_shop({
+            'name': f'bench{number}',
+            'token': f'{BENCH_BOT_ID + number}:BENCHMARK-TOKEN',
+            'admin_ids': [self.admin_id],
+            'database': os.path.join(workdir, f'bench{number}.db'),
+        }, session)
+        self.bot = self.shop.bot
+        with main.shop_context(self.shop):
+            main.setup_db()
+            # Владелец из конфигурации плюс обработчики заказов: уведомление о заказе уходит всем
+            for n in range(order_handlers):
+                main.add_admin_role(self.admin_id + 1000 * (n + 1), 'orders')
+            main.load_admins()
+
+    def seed(self, count):
+        conn = sqlite3.connect(self.shop.db_path)
+        conn.executemany(
+            "INSERT INTO cheeses (name, description, price, photo) VALUES (?, ?, ?, ?)",
+            [(f'Сыр {i}', f'Описание сыра {i}', 900 + i, f'photo-{i}') for i in range(count)]
+        )
+        conn.commit()
+        ids = [row[0] for row in conn.execute("SELECT id FROM cheeses")]
+        conn.close()
+        return ids
+
+    def latest_order_id(self):
+        conn = sqlite3.connect(self.shop.db_path)
+        row = conn.execute("SELECT MAX(id) FROM orders").fetchone()
+        conn.close()
+        return row[0]
+
+    def latest_cheese_id(self):
+        conn = sqlite3.connect(self.shop.db_path)
+        row = conn.execute("SELECT MAX(id) FROM cheeses").fetchone()
+        conn.close()
+        return row[0]
+
+
+def install_handler_probe(dp):
+    """Внутренний middleware, запоминающий, какой хэндлер обработал апдейт."""
+
+    async def probe(handler, event, data):
+        holder = current_handler.get()
+        if holder is not None:
+            holder['name'] = data['handler'].callback.__name__
+        return await handler(event, data)
+
+    dp.message.middleware(probe)
+    dp.callback_query.middleware(probe)
+
+
+# Прежняя сборка списка заказов конкатенацией f-строк — точка отсчета для шаблонов
+def legacy_order_list(orders):
+    response = "Список заказов:\n\n"
+    for order in orders:
+        telegram_username = f"@{order['telegram_username']}" if order['telegram_username'] else "Не указан"
+        response += (
+            f"Заказ ID: {order['id']}\n"
+            f"Telegram: {telegram_username}\n"
+            f"Сыр: {order['cheese_name']}\n"
+            f"Имя клиента: {order['name']}\n"
+            f"Телефон: {order['phone']}\n"
+            f"Количество: {order['quantity']} грамм\n"
+            f"Способ получения: {order['delivery_method']}\n"
+            f"Адрес: {order['address'] if order['address'] else 'Не требуется'}\n"
+            f"Время заказа: {order['timestamp']}\n"
+            f"Статус: {order['status']}\n\n"
+        )
+    return response
+
+
+def seed_orders(main, db_path, count, cheeses=300, users=30000):
+    """База для холодного старта: схема из main.setup_db и count случайных заказов."""
+    shop = main.Shop('cold', bot=None, admin_ids=[], db_path=db_path)
+    with main.shop_context(shop):
+        main.setup_db()
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO cheeses (name, description, price, photo) VALUES (?, ?, ?, ?)",
+        [(f'Сыр {i}', f'Описание сыра {i}', 900 + i, f'photo-{i}') for i in range(cheeses)]
+    )
+    conn.executemany(
+        '''
+        INSERT INTO orders (user_id, telegram_username, cheese_id, name, phone, quantity, delivery_method)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''',
+        [
+            (random.randrange(users), 'user', random.randrange(1, cheeses + 1), 'Имя', '+94000000000', 100, 'pickup')
+            for _ in range(count)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+
+async def cold_start_benchmark(main, api_server, workdir, orders, drain_updates=20, drain_delay=0.5):
+    """
+    Запускает main.py отдельным процессом против фейкового API с опросом getUpdates.
+
+    Замеряет время от запуска процесса до ответа на первый /start, затем отправляет SIGTERM,
+    пока drain_updates апдейтов ждут ответа API drain_delay секунд, и проверяет, что все они
+    получили ответ, а смещение подтверждено.
+    """
+    db_path = os.path.join(workdir, 'cold_start.db')
+    seed_orders(main, db_path, orders)
+    updates = UpdateFactory()
+    chat_id = 2_000_000
+    api_server.push_update(updates.message(chat_id, text='/start'))
+    env = dict(
+        os.environ,
+        API_TOKEN=f'{BENCH_BOT_ID + 999}:BENCHMARK-TOKEN',
+        TELEGRAM_API_URL=api_server.base_url,
+        ADMIN_IDS=str(BENCH_ADMIN_ID),
+        DB_PATH=db_path,
+        LOG_FILE=os.path.join(workdir, 'cold_start.log'),
+        LOG_FORMAT='json',
+        HEALTH_PORT='0',
+        SHOPS_CONFIG='',
+    )
+
+    replies_before = len(api_server.replies)
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(REPO_DIR, 'main.py'), cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        await api_server.wait_replies(replies_before + 1, timeout=120)
+        first_response = api_server.replies[replies_before][0] - started
+
+        api_server.delay = drain_delay
+        for n in range(drain_updates):
+            api_server.push_update(updates.message(chat_id + 1 + n, text='/start'))
+        last_update_id = updates._update_id
+        while api_server.fetched_update_id < last_update_id:
+            await asyncio.sleep(0.01)
+
+        stop_started = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        await asyncio.wait_for(process.wait(), timeout=120)
+        shutdown = time.perf_counter() - stop_started
+    finally:
+        api_server.delay = 0.0
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    drained = len({chat for _, chat in api_server.replies[replies_before:] if chat > chat_id})
+    # Разбивка изнутри процесса: импорт, готовность к опросу, первый ответ и прогрев
+    startup = {}
+    with open(env['LOG_FILE'], encoding='utf-8') as log:
+        for line in log:
+            startup = json.loads(line).get('startup', startup)
+    return {
+        'orders': orders,
+        'first_response_s': round(first_response, 3),
+        'shutdown_s': round(shutdown, 3),
+        'drained': drained,
+        'drain_updates': drain_updates,
+        'offset_confirmed': api_server.confirmed_offset > last_update_id,
+        'exit_code': process.returncode,
+        'startup': startup,
+    }
+
+
+def template_benchmark(main, count, repeats=5):
+    """Время рендера списка из count заказов: шаблоны main.py против прежней конкатенации."""
+    orders = [
+        {
+            'id': i,
+            'user_id': 1_000_000 + i,
+            'telegram_username': f'user{i}' if i % 3 else None,
+            # Примерно каждое пятидесятое значение требует HTML-экранирования
+            'cheese_name': f'Сыр {i % 50}' + (' & Ко' if i % 50 == 0 else ''),
+            'name': f'Покупатель {i}' + (' <VIP>' if i % 53 == 0 else ''),
+            'phone': f'+94 77 {i:07d}',
+            'quantity': 100 * (i % 20 + 1),
+            'delivery_method': 'Доставка' if i % 2 else 'Самовывоз',
+            'address': f'Коломбо, ул. Сырная, {i % 300}' if i % 2 else None,
+            'timestamp': '2024-01-01 12:00:00',
+            'status': 'new',
+        }
+        for i in range(count)
+    ]
+
+    def best_of(func):
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000
+
+    legacy_ms = best_of(lambda: legacy_order_list(orders))
+    template_ms = best_of(lambda: main.render_order_list(main.DEFAULT_LOCALE, orders))
+    return {
+        'orders': count,
+        'legacy_ms': round(legacy_ms, 2),
+        'template_ms': round(template_ms, 2),
+        'messages': len(main.render_order_list(main.DEFAULT_LOCALE, orders)),
+    }
+
+
+def build_report(args, wall_time, total_updates, api_server):
+    handlers = {}
+    for name, values in sorted(stats.latencies.items()):
+        values.sort()
+        handlers[name] = {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50), 3),
+            'p95_ms': round(percentile(values, 95), 3),
+            'p99_ms': round(percentile(values, 99), 3),
+            'max_ms': round(values[-1], 3),
+        }
+    flows = {}
+    for name, runs in sorted(stats.flow_runs.items()):
+        flows[name] = {
+            'runs': runs,
+            'db_ms_per_run': round(stats.flow_db_time[name] * 1000 / runs, 3),
+            'db_queries_per_run': round(stats.flow_db_queries[name] / runs, 2),
+            'api_calls_per_run': round(sum(stats.flow_api_calls[name].values()) / runs, 2),
+            'api_calls': dict(stats.flow_api_calls[name]),
+        }
+    return {
+        'version': git_version(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'params': {
+            'users': args.users,
+            'shops': args.shops,
+            'order_handlers': args.order_handlers,
+            'concurrency': args.concurrency,
+            'cheeses': args.cheeses,
+            'admin_iterations': args.admin_iterations,
+            'backup_interval': args.backup_interval,
+        },
+        'wall_time_s': round(wall_time, 3),
+        'updates': total_updates,
+        'throughput_ups': round(total_updates / wall_time, 1) if wall_time else 0.0,
+        'unhandled_updates': stats.unhandled,
+        'errors': dict(stats.errors),
+        'api_calls_total': dict(api_server.calls),
+        'handlers': handlers,
+        'flows': flows,
+    }
+
+
+def load_previous(path):
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                previous = json.loads(line)
+    return previous
+
+
+def delta(current, previous):
+    if not previous:
+        return ''
+    change = (current - previous) / previous * 100
+    return f" ({change:+.1f}%)"
+
+
+def print_report(report, previous):
+    prev_handlers = previous['handlers'] if previous else {}
+    prev_flows = previous['flows'] if previous else {}
+    if previous:
+        print(f"Сравнение с {previous['version']} от {previous['timestamp']}")
+    print(f"Версия: {report['version']}")
+    print(f"Апдейтов: {report['updates']} за {report['wall_time_s']} с, "
+          f"{report['throughput_ups']} апд/с"
+          f"{delta(report['throughput_ups'], previous['throughput_ups'] if previous else 0)}")
+    if report['backups']['count']:
+        print(f"Резервных копий во время прогона: {report['backups']['count']}, "
+              f"в среднем {report['backups']['avg_s']} с")
+    if report['loop_stalls']['count']:
+        print(f"Зависаний цикла событий: {report['loop_stalls']['count']} {report['loop_stalls']['by_handler']}")
+    if len(report['shops']) > 1:
+        for name, usage in report['shops'].items():
+            print(f"Магазин {name}: апдейтов {usage['updates']}, БД {usage['db_ms']} мс, API {usage['api_calls']}")
+    if 'templates' in report:
+        templates = report['templates']
+        print(f"Список из {templates['orders']} заказов: шаблоны {templates['template_ms']} мс "
+              f"({templates['messages']} сообщений), прежняя сборка {templates['legacy_ms']} мс")
+    log = report['logging']
+    if 'cold_start' in report:
+        cold = report['cold_start']
+        print(f"Холодный старт ({cold['orders']} заказов): первый ответ через {cold['first_response_s']} с, "
+              f"остановка {cold['shutdown_s']} с, дообработано {cold['drained']}/{cold['drain_updates']} апдейтов, "
+              f"смещение {'подтверждено' if cold['offset_confirmed'] else 'НЕ подтверждено'}, код {cold['exit_code']}")
+        split = cold['startup']
+        if split:
+            print(f"  внутри процесса: импорт {split['import_s']} с, готовность {split['ready_s']} с, "
+                  f"первый ответ {split['first_response_s']} с, прогрев "
+                  + (f"{split['warmup_s']} с" if split['warmup_s'] is not None else "прерван остановкой"))
+    print(f"Логи ({log['level']}): {log['records_per_update']} записей и {log['us_per_update']} мкс на апдейт, "
+          f"запись через очередь {log['queued_us_per_record']} мкс против {log['direct_us_per_record']} мкс напрямую"
+          + (f", отброшено {log['dropped']}" if log['dropped'] else ""))
+    if report['unhandled_updates'] or report['errors']:
+        print(f"Необработано: {report['unhandled_updates']}, ошибки: {report['errors']}")
+
+    print(f"\n{'Хэндлер':<36}{'N':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}")
+    for name, h in report['handlers'].items():
+        prev = prev_handlers.get(name, {}).get('p95_ms', 0)
+        print(f"{name:<36}{h['count']:>8}{h['p50_ms']:>10.2f}{h['p95_ms']:>10.2f}{h['p99_ms']:>10.2f}"
+              f"{delta(h['p95_ms'], prev)}")
+
+    print(f"\n{'Сценарий':<24}{'прогонов':>10}{'БД мс':>10}{'запросов':>10}{'API':>8}")
+    for name, f in report['flows'].items():
+        prev = prev_flows.get(name, {}).get('db_ms_per_run', 0)
+        print(f"{name:<24}{f['runs']:>10}{f['db_ms_per_run']:>10.2f}{f['db_queries_per_run']:>10.1f}"
+              f"{f['api_calls_per_run']:>8.1f}{delta(f['db_ms_per_run'], prev)}")
+
+
+async def run(args):
+    from aiogram.client.telegram import TelegramAPIServer
+
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix='cheese-bench-')
+    main = import_main(workdir, args.log_level)
+    install_handler_probe(main.dp)
+
+    api_server = FakeBotAPI()
+    await api_server.start()
+    # Одна сессия на все боты, как в main()
+    session = make_session_class()(api=TelegramAPIServer.from_base(api_server.base_url))
+    session.middleware(main.count_api_calls)
+    tenants = [Tenant(main, workdir, number, session, args.order_handlers) for number in range(args.shops)]
+    drivers = [Driver(tenant) for tenant in tenants]
+    cheese_ids = [tenant.seed(args.cheeses) for tenant in tenants]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def customer(user_id):
+        number = user_id % len(drivers)
+        async with semaphore:
+            await drivers[number].customer(user_id, cheese_ids[number])
+
+    # Фоновые резервные копии во время нагрузки, чтобы увидеть их влияние на задержки
+    backup_times = []
+    stop = asyncio.Event()
+
+    async def backups():
+        while not stop.is_set():
+            backup_started = time.perf_counter()
+            await main.create_backup()
+            backup_times.append(time.perf_counter() - backup_started)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=args.backup_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    background = []
+    for tenant in tenants:
+        # Задачи наследуют магазин из контекста, в котором созданы
+        with main.shop_context(tenant.shop):
+            background.append(asyncio.create_task(tenant.shop.scheduler.run()))
+            if args.backup_interval:
+                background.append(asyncio.create_task(backups()))
+    main.watchdog.start()
+
+    started = time.perf_counter()
+    tasks = [customer(1_000_000 + i) for i in range(args.users)]
+    tasks.extend(driver.admin(driver.tenant.admin_id, args.admin_iterations) for driver in drivers)
+    await asyncio.gather(*tasks)
+    wall_time = time.perf_counter() - started
+    stop.set()
+
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await session.close()
+    total_updates = sum(driver.total_updates for driver in drivers)
+    report = build_report(args, wall_time, total_updates, api_server)
+    health = main.watchdog.report()
+    report['loop_stalls'] = {
+        'count': health['stalls'],
+        'by_handler': health['stalls_by_handler'],
+    }
+    report['backups'] = {
+        'count': len(backup_times),
+        'avg_s': round(sum(backup_times) / len(backup_times), 3) if backup_times else 0.0,
+    }
+    report['shops'] = {tenant.shop.name: tenant.shop.usage_report() for tenant in tenants}
+    if args.template_orders:
+        report['templates'] = template_benchmark(main, args.template_orders)
+    if args.cold_start_orders:
+        report['cold_start'] = await cold_start_benchmark(main, api_server, workdir, args.cold_start_orders)
+    await api_server.stop()
+    report['logging'] = {
+        'level': args.log_level,
+        'records_per_update': round(stats.log_calls / total_updates, 2) if total_updates else 0.0,
+        'us_per_update': round(stats.log_time * 1e6 / total_updates, 2) if total_updates else 0.0,
+        **{key: value for key, value in health['logging'].items() if key in ('dropped', 'sampled_out')},
+        **logging_benchmark(main, workdir),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк сырного бота")
+    parser.add_argument('--users', type=int, default=1000, help="число виртуальных покупателей")
+    parser.add_argument('--concurrency', type=int, default=100, help="одновременно активных покупателей")
+    parser.add_argument('--shops', type=int, default=1, help="число магазинов на одном диспетчере")
+    parser.add_argument('--order-handlers', type=int, default=3,
+                        help="администраторов с ролью orders в каждом магазине, кроме владельца")
+    parser.add_argument('--cheeses', type=int, default=50, help="размер каталога")
+    parser.add_argument('--admin-iterations', type=int, default=20, help="циклов добавления/правки/удаления")
+    parser.add_argument('--backup-interval', type=float, default=0,
+                        help="делать резервную копию каждые N секунд во время прогона (0 — не делать)")
+    parser.add_argument('--template-orders', type=int, default=10000,
+                        help="размер списка заказов для сравнения шаблонов с конкатенацией (0 — не сравнивать)")
+    parser.add_argument('--cold-start-orders', type=int, default=100000,
+                        help="заказов в базе для замера холодного старта и остановки main.py (0 — не замерять)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--results', default=os.path.join(REPO_DIR, 'bench_results.jsonl'),
+                        help="файл с историей результатов")
+    parser.add_argument('--log-level', default='INFO', help="уровень логов бота (пишутся в каталог прогона)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    previous = load_previous(args.results)
+    print_report(report, previous)
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(report, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
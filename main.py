@@ -1,8 +1,40 @@
+import time
+
+# Момент запуска процесса: от него отсчитываются импорт, готовность и первый ответ (startup_report).
+# Импорт почти целиком занимает aiogram.types, который при загрузке достраивает pydantic-модели всех
+# типов Bot API; отложить его нельзя (без aiogram нечего запускать), поэтому откладывается только
+# работа после импорта
+STARTED_AT = time.monotonic()
+
 import sqlite3
 import asyncio
+import atexit
+import contextvars
+import gzip
+import heapq
+import html
+import itertools
+import json
 import logging
+import logging.handlers
+import math
 import os
+import queue
+import re
+import shutil
+import string
+import sys
+import threading
+import traceback
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -13,8 +45,9 @@ from aiogram.types import (
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.filters import Command
+from aiogram.filters import BaseFilter, Command, CommandObject
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.filters.state import StateFilter
 from dotenv import load_dotenv  # Для загрузки переменных из .env файла
@@ -22,22 +55,649 @@ from dotenv import load_dotenv  # Для загрузки переменных 
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования. Хэндлеры только кладут запись в очередь, а форматирование в JSON
+# и запись в stderr или файл делает фоновый поток, так что логи не тормозят цикл событий
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.getenv('LOG_FILE')  # по умолчанию stderr
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json или text
+LOG_DEBUG_SAMPLE = int(os.getenv('LOG_DEBUG_SAMPLE', 100))  # из DEBUG-записей одного вида пишем каждую N-ю
+LOG_QUEUE_SIZE = 10000  # при переполнении записи отбрасываются, а не блокируют цикл
+
+# Контекст апдейта для записей лога: магазин, update_id, пользователь и хэндлер
+log_context = contextvars.ContextVar('log_context', default=None)
+
+# Стандартные атрибуты LogRecord; все остальные (из extra=...) попадают в JSON отдельными полями
+LOG_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'context'}
+
+
+class Redacted:
+    """Персональные данные в аргументах лога: в любой записи видны только последние символы."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        text = str(self.value)
+        return f"***{text[-2:]}" if len(text) >= 8 else "***"
+
+    __repr__ = __str__
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.msg if isinstance(record.msg, str) else repr(record.msg),
+            'msg': record.getMessage(),
+        }
+        context = getattr(record, 'context', None)
+        if context:
+            entry.update(context)
+        for key, value in vars(record).items():
+            if key not in LOG_RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """Кладет записи в очередь фонового потока; в цикле событий остается только эта работа."""
+
+    def __init__(self, log_queue, debug_sample=LOG_DEBUG_SAMPLE):
+        super().__init__(log_queue)
+        self.debug_sample = debug_sample
+        self.debug_seen = Counter()  # шаблон DEBUG-записи -> сколько раз встречался
+        self.records = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.loop_time = 0.0  # сек, потраченные вызывающими потоками на постановку в очередь
+
+    def handle(self, record):
+        started = time.perf_counter()
+        try:
+            if record.levelno == logging.DEBUG and self.debug_sample > 1:
+                self.debug_seen[record.msg] += 1
+                if self.debug_seen[record.msg] % self.debug_sample != 1:
+                    self.sampled_out += 1
+                    return False
+            record.context = log_context.get()
+            return super().handle(record)
+        finally:
+            self.loop_time += time.perf_counter() - started
+
+    def prepare(self, record):
+        # В отличие от QueueHandler.prepare сообщение не форматируем: это сделает поток вывода
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= LOG_QUEUE_SIZE:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+        self.records += 1
+
+    def report(self):
+        return {
+            'records': self.records,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+            'queued': self.queue.qsize(),
+            'us_per_record': round(self.loop_time * 1e6 / self.records, 2) if self.records else 0.0,
+        }
+
+
+class CallerlessLogger(logging.Logger):
+    """Логгер без поиска места вызова: файл, строка и функция в записях не используются."""
+
+    def findCaller(self, stack_info=False, stacklevel=1):
+        if stack_info:
+            return super().findCaller(stack_info, stacklevel + 1)
+        return "(unknown file)", 0, "(unknown function)", None
+
+
+def setup_logging():
+    output = logging.FileHandler(LOG_FILE, encoding='utf-8') if LOG_FILE else logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(name)s:%(message)s'))
+
+    # Файл, строка и функция вызова, поток и процесс в записях не используются, а их сбор
+    # (обход стека в findCaller) — самая дорогая часть logger.info в вызывающем потоке.
+    # Класс действует на логгеры, созданные после настройки, в том числе на логгер бота
+    logging.setLoggerClass(CallerlessLogger)
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    # SimpleQueue реализована на C и заметно дешевле queue.Queue; размер ограничивает enqueue
+    handler = QueueLogHandler(queue.SimpleQueue())
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    atexit.register(listener.stop)  # Дописываем очередь при выходе
+    logging.basicConfig(level=LOG_LEVEL, handlers=[handler], force=True)
+    return handler
+
+
+log_handler = setup_logging()
 logger = logging.getLogger(__name__)
 
-# Токен бота и ID администратора
+# Токен бота и ID владельцев магазина (через запятую). Владельцы получают все права,
+# остальных администраторов они добавляют командой /add_admin
 API_TOKEN = os.getenv('API_TOKEN')  # Убедитесь, что в .env файле есть строка API_TOKEN=ваш_токен
-ADMIN_ID = 516337879
-# ADMIN_ID = 217444514
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # свой сервер Bot API, например локальный telegram-bot-api
+ADMIN_IDS = [int(admin_id) for admin_id in os.getenv('ADMIN_IDS', '516337879').split(',') if admin_id.strip()]
+
+# Роли администраторов: код в базе -> описание
+ADMIN_ROLES = {
+    'owner': "Владелец (все права и управление администраторами)",
+    'catalog': "Управление каталогом",
+    'orders': "Обработка заказов",
+}
+SEND_CONCURRENCY = 10  # сколько уведомлений магазин отправляет одновременно
+
+# Файл базы данных магазина (в режиме одного магазина) и размер общего пула соединений
+DB_PATH = os.getenv('DB_PATH', 'cheese_shop.db')
+DB_POOL_SIZE = 4  # свободных соединений на одну базу
+
+# Резервные копии: каталог, сколько последних копий хранить и как часто их делать
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', 7))
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', 24 * 60 * 60))  # в секундах
+BACKUP_PAGES_PER_STEP = 100  # страниц за один шаг online backup
+BACKUP_STEP_PAUSE = 0.001  # пауза между шагами, чтобы писатели успевали захватить базу
+BACKUP_SEND_LIMIT = 45 * 1024 * 1024  # копии крупнее не отправляем в Telegram (лимит 50 МБ)
+
+# Обслуживание базы данных: заказы старше ORDERS_ARCHIVE_DAYS переносятся в архив
+ORDERS_ARCHIVE_DAYS = int(os.getenv('ORDERS_ARCHIVE_DAYS', 90))
+MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', 6 * 60 * 60))  # в секундах
+
+# Статусы заказа: код в базе -> подпись для пользователя
+ORDER_STATUSES = {
+    'new': "🆕 Новый",
+    'confirmed': "✅ Подтвержден",
+    'delivered': "📦 Выдан",
+    'cancelled': "❌ Отменен",
+}
+MY_ORDERS_PAGE_SIZE = 5
+ADMIN_ORDERS_PAGE_SIZE = 15  # заказов на странице списка администратора, примерно одно сообщение
+# Таймеры: напоминание о брошенном оформлении заказа и срок жизни состояний FSM
+ORDER_REMINDER_MINUTES = int(os.getenv('ORDER_REMINDER_MINUTES', 30))
+STATE_TTL_HOURS = int(os.getenv('STATE_TTL_HOURS', 24))
+TIMERS_FLUSH_INTERVAL = 1.0  # как часто сохранять изменения таймеров в БД, в секундах
+
+# Сторож цикла событий и локальный эндпоинт состояния (по умолчанию выключен, включается HEALTH_PORT)
+WATCHDOG_INTERVAL = 0.1  # период измерения опоздания цикла, в секундах
+STALL_THRESHOLD = int(os.getenv('STALL_THRESHOLD_MS', 100)) / 1000
+STALL_STACK_DEPTH = 15  # сколько верхних кадров стека сохранять для зависания
+HEALTH_HOST = os.getenv('HEALTH_HOST', '127.0.0.1')
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', 0))
+
+# Быстрый запуск и плавная остановка: пересчет рекомендаций и прогрев кэшей откладываются до первого
+# обработанного апдейта (но не дольше WARMUP_DELAY секунд простоя), а по SIGTERM бот дожидается
+# начатой работы не дольше SHUTDOWN_TIMEOUT секунд
+WARMUP_DELAY = float(os.getenv('WARMUP_DELAY', 5))
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 25))
+MAINTENANCE_STARTUP_DELAY = 10 * 60  # первое обслуживание БД после запуска, в секундах
+BACKUP_STARTUP_DELAY = 15 * 60  # первая резервная копия после запуска, не вместе с обслуживанием
+
+RECOMMENDATIONS_TOP_N = 3  # сколько похожих сыров показывать на карточке
+MY_ORDERS_CACHE_USERS = 10000  # для скольких пользователей держать историю заказов в памяти
+
+# Тексты сообщений по языкам. Поля подставляются через {имя}, а {include:ключ} встраивает
+# другой шаблон того же языка при разборе. Значения экранируются для HTML, разметка пишется
+# прямо в шаблоне. Отсутствующие в переводе ключи берутся из DEFAULT_LOCALE
+DEFAULT_LOCALE = os.getenv('DEFAULT_LOCALE', 'ru')
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+MESSAGES = {
+    'ru': {
+        'cheese_caption': "<b>{name}</b>\n\n{description}\n\nЦена за 100г: {price} LKR.",
+        'order_contact': "Имя: {name}\nTelegram: {telegram}\n",
+        'order_details': "Телефон: {phone}\nКоличество: {quantity} грамм\nСпособ получения: {delivery_method}{address_line}",
+        'order_address': "\nАдрес: {address}",
+        'order_thanks': "Спасибо за заказ, {name}!\n\n{include:order_details}",
+        'order_new': (
+            "🆕 Новый заказ №{order_id}!\n\n{include:order_contact}{include:order_details}\n\n"
+            "🧀 Заказанный сыр: {cheese_name}"
+        ),
+        'order_list_title': "Список заказов:",
+        'order_list_item': (
+            "Заказ ID: {order_id}\n{include:order_contact}Сыр: {cheese_name}\n{include:order_details}\n"
+            "Время заказа: {timestamp}\nСтатус: {status}"
+        ),
+        'order_history_item': "Заказ №{order_id} от {timestamp}\n{cheese_name} — {quantity} грамм, {delivery_method}\nСтатус: {status}",
+        'no_username': "Не указан",
+        'unknown_cheese': "Неизвестный сыр",
+        'method_pickup': "Самовывоз",
+        'method_delivery': "Доставка",
+        'status_changed': "Статус вашего заказа №{order_id}: {status}",
+        'order_save_failed': "Не удалось сохранить заказ, попробуйте еще раз через несколько секунд.",
+        **{f'status_{status}': label for status, label in ORDER_STATUSES.items()},
+    },
+    'en': {
+        'cheese_caption': "<b>{name}</b>\n\n{description}\n\nPrice per 100g: {price} LKR.",
+        'order_contact': "Name: {name}\nTelegram: {telegram}\n",
+        'order_details': "Phone: {phone}\nQuantity: {quantity} g\nDelivery method: {delivery_method}{address_line}",
+        'order_address': "\nAddress: {address}",
+        'order_thanks': "Thank you for your order, {name}!\n\n{include:order_details}",
+        'order_new': (
+            "🆕 New order #{order_id}!\n\n{include:order_contact}{include:order_details}\n\n"
+            "🧀 Cheese: {cheese_name}"
+        ),
+        'order_list_title': "Orders:",
+        'order_list_item': (
+            "Order ID: {order_id}\n{include:order_contact}Cheese: {cheese_name}\n{include:order_details}\n"
+            "Ordered at: {timestamp}\nStatus: {status}"
+        ),
+        'order_history_item': "Order #{order_id} of {timestamp}\n{cheese_name} — {quantity} g, {delivery_method}\nStatus: {status}",
+        'no_username': "Not set",
+        'unknown_cheese': "Unknown cheese",
+        'method_pickup': "Pickup",
+        'method_delivery': "Delivery",
+        'status_changed': "Your order #{order_id} is now: {status}",
+        'order_save_failed': "Could not save your order, please try again in a few seconds.",
+        'status_new': "🆕 New",
+        'status_confirmed': "✅ Confirmed",
+        'status_delivered': "📦 Delivered",
+        'status_cancelled': "❌ Cancelled",
+    },
+}
+
+# Способ получения хранится в заказах по-русски; для перевода переводим его в ключ
+DELIVERY_METHOD_KEYS = {"Самовывоз": 'method_pickup', "Доставка": 'method_delivery'}
+
+
+class Markup(str):
+    """Готовый HTML: при подстановке в шаблон повторно не экранируется."""
+
+
+class MessageTemplate:
+    """Шаблон с раскрытыми include, один раз разобранный в строку для str.format_map."""
+
+    def __init__(self, source, catalog):
+        self.source = source
+        self.fields = []
+        parts = []
+        self._compile(source, catalog, parts, depth=0)
+        self.text = ''.join(parts)
+
+    def render(self, **values):
+        # Лишние поля игнорируются, поэтому один словарь заказа подходит всем шаблонам.
+        # Каждое поле экранируется один раз, сколько бы раз оно ни встречалось; Markup и числа пропускаются
+        fields = {}
+        for field in self.fields:
+            value = values[field]
+            fields[field] = html.escape(value, quote=False) if type(value) is str else value
+        return Markup(self.text.format_map(fields))
+
+    def _compile(self, source, catalog, parts, depth):
+        if depth > 5:
+            raise ValueError(f"Слишком глубокая вложенность include в шаблоне {source!r}")
+        for literal, field, spec, conversion in string.Formatter().parse(source):
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is None:
+                continue
+            if field == 'include':
+                self._compile(catalog[spec], catalog, parts, depth + 1)
+                continue
+            if not field.isidentifier() or spec or conversion:
+                raise ValueError(f"Недопустимое поле шаблона: {{{field}}} в {source!r}")
+            if field not in self.fields:
+                self.fields.append(field)
+            parts.append(f"{{{field}}}")
+
+
+def compile_messages(messages):
+    catalog = {**MESSAGES[DEFAULT_LOCALE], **messages}
+    return {key: MessageTemplate(source, catalog) for key, source in catalog.items()}
+
+
+TEMPLATES = {locale: compile_messages(messages) for locale, messages in MESSAGES.items()}
+
+
+# Язык пользователя по language_code из Telegram ("en-US" -> "en")
+def user_locale(user):
+    code = (user.language_code or '').split('-')[0].lower() if user else ''
+    return code if code in TEMPLATES else DEFAULT_LOCALE
+
+
+def templates_for(locale):
+    return TEMPLATES.get(locale) or TEMPLATES[DEFAULT_LOCALE]
+
+
+def render(locale, key, **values):
+    return templates_for(locale)[key].render(**values)
+
+
+def message_text(locale, key):
+    return templates_for(locale)[key].source
+
+
+def delivery_method_label(locale, delivery_method):
+    key = DELIVERY_METHOD_KEYS.get(delivery_method)
+    return message_text(locale, key) if key else delivery_method
+
+
+def status_label(locale, status):
+    key = f'status_{status}'
+    return message_text(locale, key) if key in TEMPLATES[DEFAULT_LOCALE] else status
+
+
+# Поля заказа для шаблонов order_*: одни и те же для подтверждения, уведомления и списков.
+# order — словарь с ключами name, telegram_username, phone, quantity, delivery_method, address
+def order_fields(locale, order):
+    templates = templates_for(locale)
+    username = order.get('telegram_username')
+    address = order.get('address')
+    return {
+        **order,
+        'telegram': f"@{username}" if username else templates['no_username'].source,
+        'delivery_method': delivery_method_label(locale, order['delivery_method']),
+        'address_line': templates['order_address'].render(address=address) if address else "",
+    }
+
+
+# Склеивает блоки в сообщения не длиннее лимита Telegram
+def split_message(blocks, separator="\n\n", limit=TELEGRAM_MESSAGE_LIMIT):
+    messages = []
+    current = []
+    size = 0
+    for block in blocks:
+        added = len(block) + (len(separator) if current else 0)
+        if current and size + added > limit:
+            messages.append(separator.join(current))
+            current, size = [], 0
+            added = len(block)
+        current.append(block)
+        size += added
+    if current:
+        messages.append(separator.join(current))
+    return messages
+
+
+def render_order_list(locale, orders):
+    # Шаблоны и подписи берем один раз на весь список, а не на каждый заказ.
+    # Названия сыров повторяются из заказа в заказ, поэтому экранируем каждое один раз
+    templates = templates_for(locale)
+    item = templates['order_list_item'].render
+    address_line = templates['order_address'].render
+    statuses = {status: Markup(status_label(locale, status)) for status in ORDER_STATUSES}
+    methods = {method: Markup(message_text(locale, key)) for method, key in DELIVERY_METHOD_KEYS.items()}
+    no_username = Markup(templates['no_username'].source)
+    cheese_names = {None: Markup(templates['unknown_cheese'].source)}
+
+    blocks = [templates['order_list_title'].source]
+    for order in orders:
+        username = order['telegram_username']
+        address = order['address']
+        cheese_name = cheese_names.get(order['cheese_name'])
+        if cheese_name is None:
+            cheese_name = cheese_names[order['cheese_name']] = Markup(html.escape(order['cheese_name'], quote=False))
+        blocks.append(item(
+            order_id=order['id'],
+            name=order['name'],
+            telegram=f"@{username}" if username else no_username,
+            cheese_name=cheese_name,
+            phone=order['phone'],
+            quantity=order['quantity'],
+            delivery_method=methods.get(order['delivery_method'], order['delivery_method']),
+            address_line=address_line(address=address) if address else "",
+            timestamp=order['timestamp'],
+            status=statuses.get(order['status'], order['status']),
+        ))
+    return split_message(blocks)
+
+
+# Создаем диспетчер; боты магазинов создаются при запуске в main()
+dp = Dispatcher(storage=MemoryStorage())
 
-if not API_TOKEN:
-    logger.error("API_TOKEN не установлен. Проверьте .env файл.")
-    exit(1)
 
-# Создаем объект бота и диспетчера
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# Текущий магазин (тенант): выставляется middleware по боту, принявшему апдейт,
+# и наследуется фоновыми задачами и потоками, запущенными из его контекста
+current_shop = contextvars.ContextVar('current_shop')
+
+# Все магазины процесса: ID бота -> Shop
+SHOPS = {}
+
+
+class Shop:
+    """Один магазин: свой бот, администраторы, база данных и кэши в памяти."""
+
+    def __init__(self, name, bot, admin_ids, db_path, locale=DEFAULT_LOCALE):
+        self.name = name
+        self.bot = bot
+        self.owner_ids = set(admin_ids)  # владельцы из конфигурации; записываются в таблицу admins при запуске
+        self.admins = {}  # user_id -> frozenset(ролей), копия таблицы admins
+        self.send_limiter = asyncio.Semaphore(SEND_CONCURRENCY)
+        self.background_tasks = set()  # фоновые отправки; храним ссылки, чтобы задачи не собрал GC
+        self.inflight = {}  # задача апдейта -> update_id, дожидаемся их при остановке
+        self.last_update_id = None  # последний принятый апдейт; при остановке подтверждаем его смещение
+        self.scheduler_task = None
+        self.db_path = db_path
+        self.locale = locale  # язык уведомлений администраторам
+        self.recommender = Recommender()
+        self.scheduler = TimerScheduler()
+        self.my_orders_cache = OrderedDict()  # user_id -> {before_id: (заказы, есть_еще)}
+        self.catalog_cache = {}  # клавиатуры каталога и названия сыров до первого изменения каталога
+        self.usage = Counter()  # апдейты, время хэндлеров, запросы к БД, вызовы API
+
+    def has_role(self, user_id, role=None):
+        # Без роли — любой администратор; владельцу доступны все роли
+        roles = self.admins.get(user_id)
+        return bool(roles) and (role is None or role in roles or 'owner' in roles)
+
+    def admins_with_role(self, role):
+        return [user_id for user_id in self.admins if self.has_role(user_id, role)]
+
+    def usage_report(self):
+        return {
+            'updates': self.usage['updates'],
+            'handler_ms': round(self.usage['handler_ms'], 1),
+            'db_queries': self.usage['db_queries'],
+            'db_ms': round(self.usage['db_ms'], 1),
+            'api_calls': self.usage['api_calls'],
+            'pending_timers': len(self.scheduler),
+            'cached_catalog_pages': len(self.catalog_cache),
+            'cached_order_histories': len(self.my_orders_cache),
+            'recommender_kb': round(
+                (self.recommender.cooccurrence.nbytes + self.recommender.popularity.nbytes) / 1024, 1
+            ),
+        }
+
+
+@contextmanager
+def shop_context(shop):
+    token = current_shop.set(shop)
+    try:
+        yield shop
+    finally:
+        current_shop.reset(token)
+
+
+# Конфигурация магазинов: JSON-файл из SHOPS_CONFIG со списком
+# [{"name": ..., "token": ..., "admin_ids": [...], "database": ..., "locale": ...}],
+# где admin_ids — владельцы магазина, либо один магазин из API_TOKEN / ADMIN_IDS / DB_PATH
+def load_shop_configs():
+    config_path = os.getenv('SHOPS_CONFIG')
+    if config_path:
+        with open(config_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    if not API_TOKEN:
+        logger.error("API_TOKEN не установлен. Проверьте .env файл.")
+        exit(1)
+    return [{'name': 'main', 'token': API_TOKEN, 'admin_ids': ADMIN_IDS, 'database': DB_PATH}]
+
+
+def register_shop(config, session):
+    shop = Shop(
+        name=config['name'],
+        bot=Bot(token=config['token'], session=session),
+        admin_ids=config.get('admin_ids', []),
+        db_path=config.get('database', f"{config['name']}.db"),
+        locale=config.get('locale', DEFAULT_LOCALE),
+    )
+    if shop.bot.id in SHOPS:
+        raise ValueError(f"Бот магазина {shop.name} уже зарегистрирован.")
+    SHOPS[shop.bot.id] = shop
+    logger.info("Магазин %s зарегистрирован (бот %s, база %s).", shop.name, shop.bot.id, shop.db_path)
+    return shop
+
+
+# Курсор, который учитывает время запросов в статистике текущего магазина
+class TrackedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            record_db_time(time.perf_counter() - started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            record_db_time(time.perf_counter() - started)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Соединение из общего пула: close() возвращает его в пул вместо закрытия."""
+
+    def cursor(self, factory=TrackedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_db_time(time.perf_counter() - started)
+
+    def close(self):
+        db_pool.release(self)
+
+
+def record_db_time(elapsed):
+    shop = current_shop.get(None)
+    if shop is not None:
+        shop.usage['db_queries'] += 1
+        shop.usage['db_ms'] += elapsed * 1000
+
+
+class ConnectionPool:
+    """Общий для всех магазинов пул открытых соединений SQLite, по списку свободных на каждый файл."""
+
+    def __init__(self, max_idle=DB_POOL_SIZE, factory=PooledConnection):
+        self.max_idle = max_idle
+        self.factory = factory
+        self.idle = {}  # путь к базе -> [соединение, ...]
+        self.lock = threading.Lock()
+
+    def acquire(self, db_path):
+        with self.lock:
+            idle = self.idle.get(db_path)
+            if idle:
+                return idle.pop()
+        conn = sqlite3.connect(db_path, factory=self.factory, check_same_thread=False)
+        conn.db_path = db_path
+        # Встроенные LIKE/lower в SQLite не умеют регистр для кириллицы
+        conn.create_function('casefold', 1, casefold, deterministic=True)
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            idle = self.idle.setdefault(conn.db_path, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        sqlite3.Connection.close(conn)
+
+    def close_all(self):
+        with self.lock:
+            connections = [conn for idle in self.idle.values() for conn in idle]
+            self.idle.clear()
+        for conn in connections:
+            sqlite3.Connection.close(conn)
+
+
+db_pool = ConnectionPool()
+
+
+# Соединение с базой текущего магазина; conn.close() возвращает его в пул
+def db_connect():
+    return db_pool.acquire(current_shop.get().db_path)
+
+
+def casefold(value):
+    return value.casefold() if value is not None else None
+
+
+# Администраторы текущего магазина; с ролью — только те, у кого она есть (владельцу доступно все).
+# Роли берутся из памяти магазина, в БД фильтр не ходит
+class IsAdmin(BaseFilter):
+    def __init__(self, role=None):
+        self.role = role
+
+    async def __call__(self, event: types.TelegramObject) -> bool:
+        return event.from_user is not None and current_shop.get().has_role(event.from_user.id, self.role)
+
+
+# Middleware: выбираем магазин по боту и считаем апдейты и время их обработки
+@dp.update.outer_middleware()
+async def shop_middleware(handler, event, data):
+    shop = SHOPS[data['bot'].id]
+    token = current_shop.set(shop)
+    task = asyncio.current_task()
+    shop.inflight[task] = event.update_id
+    if shop.last_update_id is None or event.update_id > shop.last_update_id:
+        shop.last_update_id = event.update_id
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        shop.inflight.pop(task, None)
+        shop.usage['updates'] += 1
+        shop.usage['handler_ms'] += (time.perf_counter() - started) * 1000
+        current_shop.reset(token)
+        if not first_response.is_set():
+            startup_report['first_response_s'] = since_start()
+            first_response.set()
+            logger.info("Первый апдейт обработан через %.2f с после запуска процесса.", startup_report['first_response_s'])
+
+
+# Общая HTTP-сессия всех ботов считает вызовы API по магазинам
+async def count_api_calls(make_request, bot, method):
+    shop = SHOPS.get(bot.id)
+    if shop is not None:
+        shop.usage['api_calls'] += 1
+    return await make_request(bot, method)
+
+
+def run_in_background(coro):
+    tasks = current_shop.get().background_tasks
+    task = asyncio.create_task(coro)
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
+
+
+def invalidate_catalog():
+    current_shop.get().catalog_cache.clear()
 
 
 # FSM для заказа
@@ -68,6 +728,16 @@ class EditCheeseForm(StatesGroup):
     description = State()
     price = State()
     photo = State()
+    search = State()
+
+
+# Поля сыра, которые можно менять по отдельности: поле -> (состояние, подсказка)
+EDIT_FIELD_PROMPTS = {
+    'name': (EditCheeseForm.name, "Введите новое название сыра:"),
+    'description': (EditCheeseForm.description, "Введите новое описание сыра:"),
+    'price': (EditCheeseForm.price, "Введите новую цену за 100 грамм:"),
+    'photo': (EditCheeseForm.photo, "Отправьте новую фотографию сыра:"),
+}
 
 class DeleteCheeseForm(StatesGroup):
     confirm = State()
@@ -76,17 +746,22 @@ class DeleteCheeseForm(StatesGroup):
 
 # Создание базы данных SQLite
 def setup_db():
-    conn = sqlite3.connect('cheese_shop.db')
+    conn = db_connect()
     cursor = conn.cursor()
+    # На новой базе инкрементальный VACUUM включается до создания таблиц и ничего не стоит;
+    # существующую базу перестраивает плановое обслуживание (run_db_maintenance)
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS cheeses (
         id INTEGER PRIMARY KEY,
         name TEXT NOT NULL,
         description TEXT NOT NULL,
         price REAL NOT NULL,
-        photo TEXT NOT NULL
+        photo TEXT NOT NULL,
+        deleted_at DATETIME  -- Мягкое удаление: сыр скрыт из каталога, но остается в истории заказов
     )
     ''')
+    ensure_column(cursor, 'cheeses', 'deleted_at', 'DATETIME')
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS orders (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -99,27 +774,773 @@ def setup_db():
         delivery_method TEXT NOT NULL,
         address TEXT,
         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        status TEXT NOT NULL DEFAULT 'new',
+        locale TEXT,  -- язык покупателя для уведомлений о смене статуса
         FOREIGN KEY (cheese_id) REFERENCES cheeses(id)
     )
     ''')
+    ensure_column(cursor, 'orders', 'status', "TEXT NOT NULL DEFAULT 'new'")
+    ensure_column(cursor, 'orders', 'locale', 'TEXT')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS orders_archive (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        telegram_username TEXT,
+        cheese_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        delivery_method TEXT NOT NULL,
+        address TEXT,
+        timestamp DATETIME,
+        archived_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        status TEXT NOT NULL DEFAULT 'new',
+        locale TEXT
+    )
+    ''')
+    ensure_column(cursor, 'orders_archive', 'status', "TEXT NOT NULL DEFAULT 'new'")
+    ensure_column(cursor, 'orders_archive', 'locale', 'TEXT')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS timers (
+        key TEXT PRIMARY KEY,
+        due REAL NOT NULL,  -- Unix-время срабатывания
+        kind TEXT NOT NULL,
+        payload TEXT  -- JSON
+    )
+    ''')
+    # Уведомления о заказах у администраторов: при смене статуса обновляются кнопки у всех
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_notifications (
+        order_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        PRIMARY KEY (order_id, chat_id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS admins (
+        user_id INTEGER NOT NULL,
+        role TEXT NOT NULL,  -- код из ADMIN_ROLES
+        added_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, role)
+    )
+    ''')
+    # Владельцы из конфигурации всегда есть в таблице
+    cursor.executemany(
+        "INSERT OR IGNORE INTO admins (user_id, role) VALUES (?, 'owner')",
+        [(user_id,) for user_id in current_shop.get().owner_ids]
+    )
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_timestamp ON orders(timestamp)')
+    # История заказов пользователя читается по (user_id, id) с конца
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_archive_user_id ON orders_archive(user_id, id)')
     conn.commit()
     conn.close()
     logger.info("База данных настроена.")
 
 
+# Добавление колонки в существующую таблицу (миграция старых баз)
+def ensure_column(cursor, table, column, definition):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info("В таблицу %s добавлена колонка %s.", table, column)
+
+
+# Перенос старых заказов в архив небольшими пачками, чтобы не держать блокировку записи
+def archive_old_orders(days=ORDERS_ARCHIVE_DAYS, batch_size=5000):
+    conn = db_connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT datetime('now', ?)", (f'-{days} days',))
+    cutoff = cursor.fetchone()[0]
+
+    archived = 0
+    while True:
+        cursor.execute(
+            'SELECT id FROM orders WHERE timestamp < ? ORDER BY id LIMIT ?',
+            (cutoff, batch_size)
+        )
+        ids = [(row[0],) for row in cursor.fetchall()]
+        if not ids:
+            break
+        cursor.executemany('''
+        INSERT OR REPLACE INTO orders_archive
+            (id, user_id, telegram_username, cheese_id, name, phone, quantity, delivery_method, address, timestamp, status, locale)
+        SELECT id, user_id, telegram_username, cheese_id, name, phone, quantity, delivery_method, address, timestamp, status, locale
+        FROM orders WHERE id = ?
+        ''', ids)
+        cursor.executemany('DELETE FROM orders WHERE id = ?', ids)
+        cursor.executemany('DELETE FROM order_notifications WHERE order_id = ?', ids)
+        conn.commit()
+        archived += len(ids)
+
+    conn.close()
+    return archived
+
+
+# Плановое обслуживание: архивирование, возврат свободных страниц и обновление статистики
+def run_db_maintenance():
+    archived = archive_old_orders()
+
+    conn = db_connect()
+    cursor = conn.cursor()
+    # В старой базе инкрементальный VACUUM включается только полной перестройкой файла, которая
+    # держит блокировку записи все время работы. Здесь ее не делаем: только офлайн, python main.py --vacuum
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] != 2:
+        logger.warning(
+            "В базе %s не включен инкрементальный VACUUM; остановите бота и выполните: python main.py --vacuum",
+            current_shop.get().db_path
+        )
+    cursor.execute('PRAGMA freelist_count')
+    free_pages = cursor.fetchone()[0]
+    cursor.execute('PRAGMA incremental_vacuum')
+    cursor.fetchall()
+    cursor.execute('PRAGMA optimize')
+    conn.close()
+    logger.info("Обслуживание БД: в архив перенесено заказов: %s, освобождено страниц: %s.", archived, free_pages)
+
+
+# Офлайн-шаг для баз, созданных до включения auto_vacuum: полная перестройка файла.
+# Запускается при остановленном боте, потому что VACUUM блокирует запись на все время работы
+def enable_incremental_vacuum():
+    for config in load_shop_configs():
+        db_path = config.get('database', f"{config['name']}.db")
+        if not os.path.exists(db_path):
+            continue
+        conn = sqlite3.connect(db_path)
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            logger.info("База %s: инкрементальный VACUUM уже включен.", db_path)
+        else:
+            started = time.perf_counter()
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            logger.info("База %s: инкрементальный VACUUM включен за %.2f с.", db_path, time.perf_counter() - started)
+        conn.close()
+
+
+# Онлайн-копия базы через SQLite backup API: копируем по BACKUP_PAGES_PER_STEP страниц,
+# между шагами отпускаем блокировку, поэтому запись в базу во время копирования не останавливается
+def backup_database():
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    prefix = current_shop.get().name
+    raw_path = os.path.join(BACKUP_DIR, f"{prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db")
+
+    source = db_connect()
+    target = sqlite3.connect(raw_path)
+    try:
+        source.backup(
+            target,
+            pages=BACKUP_PAGES_PER_STEP,
+            progress=lambda status, remaining, total: time.sleep(BACKUP_STEP_PAUSE)
+        )
+    finally:
+        target.close()
+        source.close()
+
+    backup_path = raw_path + '.gz'
+    with open(raw_path, 'rb') as raw, gzip.open(backup_path, 'wb', compresslevel=6) as compressed:
+        shutil.copyfileobj(raw, compressed, 1024 * 1024)
+    os.remove(raw_path)
+
+    rotate_backups(prefix)
+    return backup_path
+
+
+# Удаление старых копий, остаются BACKUP_KEEP последних. Имя сверяется целиком:
+# иначе копии магазина main совпали бы и с копиями магазина main-eu
+def rotate_backups(prefix):
+    pattern = re.compile(rf"{re.escape(prefix)}-\d{{8}}-\d{{6}}\.db\.gz")
+    backups = sorted(name for name in os.listdir(BACKUP_DIR) if pattern.fullmatch(name))
+    for name in backups[:-BACKUP_KEEP]:
+        os.remove(os.path.join(BACKUP_DIR, name))
+        logger.info("Удалена устаревшая резервная копия: %s", name)
+
+
+backup_lock = asyncio.Lock()
+
+
+async def create_backup():
+    # Копирование идет в отдельном потоке, цикл событий продолжает обрабатывать апдейты
+    async with backup_lock:
+        started = time.perf_counter()
+        backup_path = await asyncio.to_thread(backup_database)
+        logger.info("Резервная копия %s создана за %.2f с.", backup_path, time.perf_counter() - started)
+        return backup_path
+
+
+# Рекомендации: популярность сыров и матрица совместных покупок.
+# Два сыра считаются купленными вместе, если их заказывал один и тот же покупатель.
+# Все хранится в памяти и обновляется на каждый заказ, готовые top-N отдаются без обращения к БД.
+class Recommender:
+    def __init__(self, top_n=RECOMMENDATIONS_TOP_N):
+        self.top_n = top_n
+        self.index = {}  # cheese_id -> номер строки/столбца матрицы
+        self.cheese_ids = np.zeros(0, dtype=np.int64)  # номер -> cheese_id
+        self.popularity = np.zeros(0, dtype=np.int64)
+        self.cooccurrence = np.zeros((0, 0), dtype=np.int32)
+        self.user_cheeses = {}  # user_id -> множество номеров сыров, которые он заказывал
+        self.top = {}  # cheese_id -> [cheese_id, ...]
+        self.weakest = np.zeros(0, dtype=np.int64)  # номер -> номер последнего сыра в его top-N
+
+    def _slot(self, cheese_id):
+        slot = self.index.get(cheese_id)
+        if slot is not None:
+            return slot
+
+        slot = len(self.index)
+        capacity = len(self.popularity)
+        if slot >= capacity:
+            # Растим массивы с удвоением, чтобы новые сыры не копировали матрицу каждый раз
+            new_capacity = max(16, capacity * 2)
+            cooccurrence = np.zeros((new_capacity, new_capacity), dtype=np.int32)
+            cooccurrence[:capacity, :capacity] = self.cooccurrence
+            self.cooccurrence = cooccurrence
+            self.popularity = np.concatenate([self.popularity, np.zeros(new_capacity - capacity, dtype=np.int64)])
+            self.cheese_ids = np.concatenate([self.cheese_ids, np.zeros(new_capacity - capacity, dtype=np.int64)])
+            self.weakest = np.concatenate([self.weakest, np.full(new_capacity - capacity, -1, dtype=np.int64)])
+        self.index[cheese_id] = slot
+        self.cheese_ids[slot] = cheese_id
+        return slot
+
+    def _refresh_top(self, slot):
+        size = len(self.index)
+        row = self.cooccurrence[slot, :size]
+        candidates = np.flatnonzero(row)
+        # Сначала по числу совместных покупок, при равенстве — по популярности, затем по меньшему id.
+        # Первые два условия сведены в один ключ, чтобы отбор top-N не резал равные по покупкам
+        # сыры вслепую; на границе берем всех с пороговым ключом и разбираем их сортировкой
+        popularity = self.popularity[candidates]
+        keys = row[candidates].astype(np.int64) * (int(popularity.max(initial=0)) + 1) + popularity
+        if len(candidates) > self.top_n:
+            threshold = np.partition(keys, len(keys) - self.top_n)[len(keys) - self.top_n]
+            candidates, keys = candidates[keys >= threshold], keys[keys >= threshold]
+        candidates = candidates[np.lexsort((self.cheese_ids[candidates], -keys))[:self.top_n]]
+        self.top[int(self.cheese_ids[slot])] = [int(c) for c in self.cheese_ids[candidates]]
+        self.weakest[slot] = candidates[-1] if len(candidates) else -1
+
+    def _rank(self, slot, other):
+        return int(self.cooccurrence[slot, other]), int(self.popularity[other]), -int(self.cheese_ids[other])
+
+    # Выросла популярность сыра: он может подняться в списках сыров, с которыми его покупали.
+    # Остальные ключи не менялись, поэтому список достаточно пересортировать, если сыр в нем уже
+    # есть, или поставить сыр на место последнего, если теперь он его обгоняет
+    def _promote(self, slot, refreshed):
+        others = np.flatnonzero(self.cooccurrence[slot, :len(self.index)])
+        if refreshed:
+            others = others[~np.isin(others, list(refreshed))]
+        if not len(others):
+            return
+
+        # Сравниваем сыр с последним в каждом списке сразу по всем спискам; списки, где он уже есть,
+        # тоже проходят проверку, так как он не слабее последнего
+        weakest = self.weakest[others]
+        rows = self.cooccurrence[others, slot]
+        weakest_rows = self.cooccurrence[others, weakest]
+        popularity, weakest_popularity = self.popularity[slot], self.popularity[weakest]
+        ahead = (rows > weakest_rows) | (rows == weakest_rows) & (
+            (popularity > weakest_popularity)
+            | (popularity == weakest_popularity) & (self.cheese_ids[slot] <= self.cheese_ids[weakest])
+        )
+
+        cheese_id = int(self.cheese_ids[slot])
+        for other in others[ahead].tolist():
+            top = self.top[int(self.cheese_ids[other])]
+            if cheese_id not in top:
+                top[-1] = cheese_id
+            top.sort(key=lambda c: self._rank(other, self.index[c]), reverse=True)
+            self.weakest[other] = self.index[top[-1]]
+
+    def add_order(self, user_id, cheese_id):
+        slot = self._slot(cheese_id)
+        self.popularity[slot] += 1
+
+        seen = self.user_cheeses.setdefault(user_id, set())
+        refreshed = set()
+        if slot not in seen:
+            if seen:
+                others = np.fromiter(seen, dtype=np.int64, count=len(seen))
+                self.cooccurrence[slot, others] += 1
+                self.cooccurrence[others, slot] += 1
+                refreshed = seen | {slot}
+                for other in refreshed:
+                    self._refresh_top(other)
+            seen.add(slot)
+        self._promote(slot, refreshed)
+
+    def rebuild(self, orders, users_per_chunk=4096):
+        """Полный пересчет по списку пар (user_id, cheese_id)."""
+        self.__init__(self.top_n)
+        if len(orders) == 0:
+            return
+
+        pairs = np.asarray(orders, dtype=np.int64)
+        cheese_ids, cheese_slots = np.unique(pairs[:, 1], return_inverse=True)
+        users, user_rows = np.unique(pairs[:, 0], return_inverse=True)
+        for cheese_id in cheese_ids:
+            self._slot(int(cheese_id))
+        size = len(cheese_ids)
+        self.popularity[:size] = np.bincount(cheese_slots, minlength=size)
+
+        # Уникальные пары покупатель-сыр, отсортированные по покупателю
+        unique_pairs = np.unique(user_rows * size + cheese_slots)
+        pair_users, pair_slots = np.divmod(unique_pairs, size)
+        for user_id, slot in zip(users[pair_users].tolist(), pair_slots.tolist()):
+            self.user_cheeses.setdefault(user_id, set()).add(slot)
+
+        # C = Bᵀ·B по блокам покупателей, где B — матрица «покупатель × сыр» из нулей и единиц
+        cooccurrence = np.zeros((size, size), dtype=np.float64)
+        bounds = np.searchsorted(pair_users, np.arange(0, len(users) + users_per_chunk, users_per_chunk))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            chunk_users = pair_users[start:end]
+            incidence = np.zeros((chunk_users[-1] - chunk_users[0] + 1, size), dtype=np.float32)
+            incidence[chunk_users - chunk_users[0], pair_slots[start:end]] = 1
+            cooccurrence += incidence.T @ incidence
+        np.fill_diagonal(cooccurrence, 0)
+        self.cooccurrence[:size, :size] = cooccurrence.astype(np.int32)
+
+        for slot in range(size):
+            self._refresh_top(slot)
+
+    def recommend(self, cheese_id):
+        return self.top.get(cheese_id, [])
+
+    def sort_by_popularity(self, cheese_ids):
+        return sorted(cheese_ids, key=lambda cheese_id: (-self.popularity_of(cheese_id), cheese_id))
+
+    def popularity_of(self, cheese_id):
+        slot = self.index.get(cheese_id)
+        return int(self.popularity[slot]) if slot is not None else 0
+
+
+# Пересчет рекомендаций по всем заказам, включая архивные. Матрица строится в отдельном потоке
+# на новом объекте: хэндлеры в это время работают со старым, а заказы, сохраненные за время
+# пересчета, досчитываются в цикле событий перед заменой
+async def rebuild_recommendations():
+    shop = current_shop.get()
+    started = time.perf_counter()
+    recommender, last_order_id, total = await asyncio.to_thread(build_recommender)
+
+    conn = db_connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, cheese_id FROM orders WHERE id > ? ORDER BY id", (last_order_id,))
+    for user_id, cheese_id in cursor.fetchall():
+        recommender.add_order(user_id, cheese_id)
+    conn.close()
+    shop.recommender = recommender
+    logger.info("Рекомендации пересчитаны по %s заказам за %.2f с.", total, time.perf_counter() - started)
+
+
+def build_recommender():
+    conn = db_connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT id, user_id, cheese_id FROM orders
+    UNION ALL
+    SELECT id, user_id, cheese_id FROM orders_archive
+    ''')
+    orders = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+    conn.close()
+
+    recommender = Recommender()
+    recommender.rebuild(orders[:, 1:])
+    return recommender, int(orders[:, 0].max(initial=0)), len(orders)
+
+
+# Планировщик таймеров: куча с ленивым удалением поверх цикла событий.
+# Один фоновый цикл спит до ближайшего срока, поэтому сотни тысяч отложенных таймеров
+# стоят только записи в куче и словаре. Изменения пачками сохраняются в таблицу timers
+# и переживают перезапуск бота.
+class TimerScheduler:
+    def __init__(self, flush_interval=TIMERS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.heap = []  # (срок, порядковый номер, ключ); устаревшие записи пропускаются при извлечении
+        self.timers = {}  # ключ -> (срок, порядковый номер, тип, данные)
+        self._seq = itertools.count()
+        self._pending = {}  # ключ -> (срок, тип, данные) или None для удаления; еще не сохранено в БД
+        self._wakeup = asyncio.Event()
+        self._running = set()
+
+    def schedule(self, key, delay, kind, payload=None):
+        due = time.time() + delay
+        seq = next(self._seq)
+        self.timers[key] = (due, seq, kind, payload)
+        heapq.heappush(self.heap, (due, seq, key))
+        self._pending[key] = (due, kind, payload)
+        if self.heap[0][2] == key:
+            self._wakeup.set()  # Новый таймер раньше всех остальных, перестраиваем сон
+
+    def cancel(self, key):
+        if self.timers.pop(key, None) is not None:
+            self._pending[key] = None
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def __len__(self):
+        return len(self.timers)
+
+    def load(self):
+        conn = db_connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT key, due, kind, payload FROM timers")
+        for key, due, kind, payload in cursor.fetchall():
+            seq = next(self._seq)
+            self.timers[key] = (due, seq, kind, json.loads(payload) if payload else None)
+            self.heap.append((due, seq, key))
+        conn.close()
+        heapq.heapify(self.heap)
+        logger.info("Загружено отложенных таймеров: %s.", len(self.timers))
+
+    def take_pending(self):
+        pending, self._pending = self._pending, {}
+        return pending
+
+    @staticmethod
+    def save(pending):
+        if not pending:
+            return
+        conn = db_connect()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO timers (key, due, kind, payload) VALUES (?, ?, ?, ?)",
+            [
+                (key, timer[0], timer[1], json.dumps(timer[2]) if timer[2] is not None else None)
+                for key, timer in pending.items() if timer is not None
+            ]
+        )
+        cursor.executemany(
+            "DELETE FROM timers WHERE key = ?",
+            [(key,) for key, timer in pending.items() if timer is None]
+        )
+        conn.commit()
+        conn.close()
+
+    def _pop_due(self, now):
+        due_timers = []
+        while self.heap and self.heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self.heap)
+            timer = self.timers.get(key)
+            if timer is None or timer[1] != seq:
+                continue  # Таймер отменен или переназначен
+            del self.timers[key]
+            self._pending[key] = None
+            due_timers.append((key, timer[2], timer[3]))
+
+        # Слишком много устаревших записей — пересобираем кучу из живых таймеров
+        if len(self.heap) > 2 * len(self.timers) + 1024:
+            self.heap = [(due, seq, key) for key, (due, seq, _, _) in self.timers.items()]
+            heapq.heapify(self.heap)
+        return due_timers
+
+    async def _fire(self, key, kind, payload):
+        handler = TIMER_HANDLERS.get(kind)
+        if handler is None:
+            logger.error("Нет обработчика для таймера %s типа %s.", key, kind)
+            return
+        try:
+            await handler(key, payload)
+        except Exception as e:
+            logger.error("Ошибка при срабатывании таймера %s: %s", key, e)
+
+    async def run(self):
+        last_flush = time.monotonic()
+        try:
+            while True:
+                for key, kind, payload in self._pop_due(time.time()):
+                    task = asyncio.create_task(self._fire(key, kind, payload))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    # Изменения забираем в цикле событий, а пишем в БД в отдельном потоке
+                    await asyncio.to_thread(self.save, self.take_pending())
+                    last_flush = time.monotonic()
+
+                timeout = self.flush_interval
+                if self.heap:
+                    timeout = min(timeout, max(0, self.heap[0][0] - time.time()))
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.save(self.take_pending())
+
+
+# Обработчики таймеров по типу; общие для планировщиков всех магазинов
+TIMER_HANDLERS = {}
+
+
+def timer_handler(kind):
+    def decorator(func):
+        TIMER_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+# Напоминание о незавершенном заказе и сброс зависших состояний FSM
+async def update_state_timers(state: FSMContext):
+    scheduler = current_shop.get().scheduler
+    key = f"{state.key.chat_id}:{state.key.user_id}"
+    current_state = await state.get_state()
+    if current_state is None:
+        scheduler.cancel(f"order_reminder:{key}")
+        scheduler.cancel(f"state_expiry:{key}")
+        return
+
+    payload = {'bot_id': state.key.bot_id, 'chat_id': state.key.chat_id, 'user_id': state.key.user_id}
+    scheduler.schedule(f"state_expiry:{key}", STATE_TTL_HOURS * 60 * 60, 'state_expiry', payload)
+    if current_state.startswith(f"{OrderForm.__name__}:"):
+        scheduler.schedule(f"order_reminder:{key}", ORDER_REMINDER_MINUTES * 60, 'order_reminder', payload)
+    else:
+        scheduler.cancel(f"order_reminder:{key}")
+
+
+def stored_state(payload):
+    return FSMContext(
+        storage=dp.storage,
+        key=StorageKey(bot_id=payload['bot_id'], chat_id=payload['chat_id'], user_id=payload['user_id'])
+    )
+
+
+@timer_handler('order_reminder')
+async def send_order_reminder(key, payload):
+    current_state = await stored_state(payload).get_state()
+    if not current_state or not current_state.startswith(f"{OrderForm.__name__}:"):
+        return
+    await current_shop.get().bot.send_message(
+        payload['chat_id'],
+        "Вы не завершили оформление заказа. Продолжите с того же шага или отмените заказ.",
+        reply_markup=cancel_order_keyboard()
+    )
+    logger.info("Пользователю %s отправлено напоминание о незавершенном заказе.", payload['user_id'])
+
+
+@timer_handler('state_expiry')
+async def expire_state(key, payload):
+    await stored_state(payload).clear()
+    current_shop.get().scheduler.cancel(f"order_reminder:{payload['chat_id']}:{payload['user_id']}")
+    logger.info("Состояние пользователя %s сброшено по истечении %s ч.", payload['user_id'], STATE_TTL_HOURS)
+
+
+# Периодические задачи обслуживания тоже живут в планировщике и переназначают себя сами
+@timer_handler('maintenance')
+async def maintenance_job(key, payload):
+    try:
+        await asyncio.to_thread(run_db_maintenance)
+    finally:
+        current_shop.get().scheduler.schedule(key, MAINTENANCE_INTERVAL, 'maintenance')
+
+
+@timer_handler('backup')
+async def backup_job(key, payload):
+    try:
+        await create_backup()
+    finally:
+        current_shop.get().scheduler.schedule(key, BACKUP_INTERVAL, 'backup')
+
+
+def schedule_periodic_jobs():
+    # Не сразу: архивирование, PRAGMA optimize и резервная копия не должны конкурировать с первыми
+    # апдейтами. Таймеры из БД, срок которых прошел за время простоя, сдвигаются на ту же задержку
+    scheduler = current_shop.get().scheduler
+    for kind, first_delay, startup_delay in (
+        ('maintenance', MAINTENANCE_STARTUP_DELAY, MAINTENANCE_STARTUP_DELAY),
+        ('backup', BACKUP_INTERVAL, BACKUP_STARTUP_DELAY),
+    ):
+        if kind not in scheduler:
+            scheduler.schedule(kind, first_delay, kind)
+        elif scheduler.timers[kind][0] < time.time() + startup_delay:
+            scheduler.schedule(kind, startup_delay, kind)
+
+
+# Middleware: после каждого хэндлера переназначаем таймеры по новому состоянию FSM
+async def state_timers_middleware(handler, event, data):
+    result = await handler(event, data)
+    state = data.get('state')
+    if state is not None:
+        await update_state_timers(state)
+    return result
+
+
+dp.message.middleware(state_timers_middleware)
+dp.callback_query.middleware(state_timers_middleware)
+
+
+# Сторож цикла событий. Корутина-пульс раз в WATCHDOG_INTERVAL измеряет опоздание цикла,
+# а отдельный поток замечает, что пульс пропал, и снимает стек потока цикла прямо во время
+# блокировки. Так видно, какой хэндлер и какой апдейт остановили бота.
+class LoopWatchdog:
+    def __init__(self, interval=WATCHDOG_INTERVAL, threshold=STALL_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=int(60 / interval))  # опоздания цикла за последнюю минуту, сек
+        self.stalls = deque(maxlen=50)  # последние зависания
+        self.stalls_by_handler = Counter()
+        self.stalls_by_shop = defaultdict(Counter)  # магазин -> хэндлер -> число зависаний
+        self.stall_count = 0
+        self.inflight = {}  # задача -> {'update_id', 'user_id', 'handler'}
+        self.started_at = time.time()
+        self.last_beat = time.monotonic()
+        self._loop = None
+        self._loop_thread_id = None
+        self._capture = None  # снимок, сделанный потоком во время текущей блокировки
+        self._handler_codes = {}
+        self._task = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._handler_codes = {
+            handler.callback.__code__: handler.callback.__name__
+            for observer in (dp.message, dp.callback_query)
+            for handler in observer.handlers
+        }
+        self.last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True).start()
+
+    async def _heartbeat(self):
+        while True:
+            expected = self._loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self._loop.time() - expected)
+            self.last_beat = time.monotonic()
+            self.lags.append(lag)
+            if lag >= self.threshold:
+                self._record_stall(lag)
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.interval / 2)
+            if self._capture is None and time.monotonic() - self.last_beat > self.interval + self.threshold:
+                self._capture = self._snapshot()
+
+    def _snapshot(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame)
+        task = asyncio.current_task(self._loop)
+        context = dict(self.inflight.get(task, {}))
+        if not context.get('handler'):
+            # Апдейт не привязан к задаче — ищем хэндлер по стеку
+            for code in self._frame_codes(frame):
+                if code in self._handler_codes:
+                    context['handler'] = self._handler_codes[code]
+                    break
+        context['stack'] = traceback.format_list(stack[-STALL_STACK_DEPTH:])
+        return context
+
+    @staticmethod
+    def _frame_codes(frame):
+        while frame is not None:
+            yield frame.f_code
+            frame = frame.f_back
+
+    def _record_stall(self, lag):
+        capture, self._capture = self._capture, None
+        stall = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'duration_ms': round(lag * 1000, 1),
+            'handler': None,
+            'shop': None,
+            'update_id': None,
+            'user_id': None,
+            'stack': None,
+        }
+        if capture:
+            stall.update(capture)
+        self.stalls.append(stall)
+        self.stall_count += 1
+        self.stalls_by_handler[stall['handler'] or 'неизвестно'] += 1
+        self.stalls_by_shop[stall['shop']][stall['handler'] or 'неизвестно'] += 1
+        logger.warning(
+            "Цикл событий заблокирован на %s мс: хэндлер %s, апдейт %s, пользователь %s",
+            stall['duration_ms'], stall['handler'], stall['update_id'], stall['user_id'],
+            extra={'stack': ''.join(stall['stack']) if stall['stack'] else None}
+        )
+
+    def report(self):
+        lags = sorted(self.lags) or [0.0]
+        return {
+            'uptime_s': round(time.time() - self.started_at),
+            'loop_lag_ms': {
+                'last': round(self.lags[-1] * 1000 if self.lags else 0.0, 2),
+                'p99': round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+                'max': round(lags[-1] * 1000, 2),
+            },
+            'stalls': self.stall_count,
+            'stalls_by_handler': dict(self.stalls_by_handler.most_common()),
+            'recent_stalls': list(self.stalls)[-5:],
+            'inflight_updates': len(self.inflight),
+            'pending_timers': sum(len(shop.scheduler) for shop in SHOPS.values()),
+            'shops': {shop.name: shop.usage_report() for shop in SHOPS.values()},
+            'logging': log_handler.report(),
+            'startup': dict(startup_report),
+        }
+
+
+watchdog = LoopWatchdog()
+
+
+# Middleware: запоминаем, какой апдейт и хэндлер выполняются в текущей задаче.
+# Тот же словарь становится контекстом всех записей лога, сделанных во время обработки
+async def watchdog_middleware(handler, event, data):
+    task = asyncio.current_task()
+    context = watchdog.inflight[task] = {
+        'shop': current_shop.get().name,
+        'update_id': data['event_update'].update_id,
+        'user_id': event.from_user.id if event.from_user else None,
+        'handler': data['handler'].callback.__name__,
+    }
+    token = log_context.set(context)
+    try:
+        return await handler(event, data)
+    finally:
+        log_context.reset(token)
+        watchdog.inflight.pop(task, None)
+
+
+dp.message.middleware(watchdog_middleware)
+dp.callback_query.middleware(watchdog_middleware)
+
+
+# Локальный HTTP-эндпоинт состояния: GET /health
+async def start_health_server():
+    app = web.Application()
+    app.router.add_get('/health', lambda request: web.json_response(watchdog.report()))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, HEALTH_HOST, HEALTH_PORT).start()
+    except OSError as e:
+        # Занятый порт (например, второй процесс бота на той же машине) не должен мешать запуску
+        logger.error("Не удалось открыть эндпоинт состояния на %s:%s: %s", HEALTH_HOST, HEALTH_PORT, e)
+        await runner.cleanup()
+        return None
+    logger.info("Эндпоинт состояния доступен на http://%s:%s/health", HEALTH_HOST, HEALTH_PORT)
+    return runner
+
 
 
 # Главное меню
-def main_menu(is_admin=False):
+def main_menu(manage_catalog=False, handle_orders=False):
     keyboard = [
-        [KeyboardButton(text="Каталог")],
+        [KeyboardButton(text="Каталог"), KeyboardButton(text="Мои заказы")],
         [KeyboardButton(text="О нас"), KeyboardButton(text="Контакты")]
     ]
 
-    if is_admin:
-        # Добавляем кнопки только для администраторов
+    # Кнопки администраторов — по их ролям
+    if manage_catalog:
         keyboard.append([KeyboardButton(text="Добавить сыр"), KeyboardButton(text="Редактировать сыр")])
-        keyboard.append([KeyboardButton(text="Удалить сыр"), KeyboardButton(text="Просмотреть заказы")])
+        keyboard.append([KeyboardButton(text="Удалить сыр")])
+    if handle_orders:
+        keyboard.append([KeyboardButton(text="Просмотреть заказы")])
 
     return ReplyKeyboardMarkup(
         keyboard=keyboard,
@@ -127,11 +1548,17 @@ def main_menu(is_admin=False):
     )
 
 
-# Получение списка сыров из базы данных с поддержкой пагинации
-def get_cheeses(offset=0, limit=10):
-    conn = sqlite3.connect('cheese_shop.db')
+# Получение списка сыров из базы данных с поддержкой пагинации и поиска по названию
+def get_cheeses(offset=0, limit=10, query=None):
+    conn = db_connect()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM cheeses LIMIT ? OFFSET ?', (limit, offset))
+    if query:
+        cursor.execute(
+            'SELECT * FROM cheeses WHERE deleted_at IS NULL AND instr(casefold(name), ?) > 0 LIMIT ? OFFSET ?',
+            (query.casefold(), limit, offset)
+        )
+    else:
+        cursor.execute('SELECT * FROM cheeses WHERE deleted_at IS NULL LIMIT ? OFFSET ?', (limit, offset))
     cheeses = cursor.fetchall()
     conn.close()
     return cheeses
@@ -139,6 +1566,11 @@ def get_cheeses(offset=0, limit=10):
 
 # Пагинация каталога
 def catalog_pagination(page=0, limit=10):
+    catalog_cache = current_shop.get().catalog_cache
+    cache_key = ('catalog', page, limit)
+    if cache_key in catalog_cache:
+        return catalog_cache[cache_key]
+
     builder = InlineKeyboardBuilder()
     offset = page * limit
     cheeses = get_cheeses(offset=offset, limit=limit + 1)  # Запрашиваем на одну запись больше
@@ -162,17 +1594,53 @@ def catalog_pagination(page=0, limit=10):
     if navigation_buttons:
         builder.row(*navigation_buttons)  # Навигационные кнопки на отдельной строке
 
+    builder.row(InlineKeyboardButton(text="🔥 Популярное", callback_data="popular_0"))
+    catalog_cache[cache_key] = builder.as_markup()
+    return catalog_cache[cache_key]
+
+
+# Каталог, отсортированный по популярности (число заказов берется из памяти рекомендателя)
+def popular_pagination(page=0, limit=10):
+    catalog_cache = current_shop.get().catalog_cache
+    names = catalog_cache.get(('names',))
+    if names is None:
+        conn = db_connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name FROM cheeses WHERE deleted_at IS NULL")
+        names = catalog_cache[('names',)] = dict(cursor.fetchall())
+        conn.close()
+
+    ranked = current_shop.get().recommender.sort_by_popularity(names)
+    offset = page * limit
+    page_ids = ranked[offset:offset + limit]
+
+    builder = InlineKeyboardBuilder()
+    for cheese_id in page_ids:
+        builder.add(InlineKeyboardButton(text=names[cheese_id], callback_data=f"cheese_{cheese_id}"))
+
+    builder.adjust(2)  # Размещаем по 2 кнопки в строку
+
+    navigation_buttons = []
+    if page > 0:
+        navigation_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"popular_{page-1}"))
+    if len(ranked) > offset + limit:
+        navigation_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"popular_{page+1}"))
+
+    if navigation_buttons:
+        builder.row(*navigation_buttons)  # Навигационные кнопки на отдельной строке
+
+    builder.row(InlineKeyboardButton(text="📋 Весь каталог", callback_data="catalog_all_0"))
     return builder.as_markup()
 
 # Обработка кнопки "Добавить сыр"
-@dp.message(F.text == "Добавить сыр", F.from_user.id == ADMIN_ID)
+@dp.message(F.text == "Добавить сыр", IsAdmin('catalog'))
 async def add_cheese_button(message: types.Message, state: FSMContext):
     await add_cheese(message, state)
 
 # Обработка кнопки "Редактировать сыр"
-@dp.message(F.text == "Редактировать сыр", F.from_user.id == ADMIN_ID)
+@dp.message(F.text == "Редактировать сыр", IsAdmin('catalog'))
 async def edit_cheese_button(message: types.Message, state: FSMContext):
-    await edit_cheese(message, state)
+    await show_edit_picker(message, state)
 
 
 
@@ -180,13 +1648,16 @@ async def edit_cheese_button(message: types.Message, state: FSMContext):
 # Стартовый хэндлер
 @dp.message(Command("start"))
 async def send_welcome(message: types.Message):
-    is_admin = message.from_user.id == ADMIN_ID
+    shop = current_shop.get()
     await message.answer(
         "Добро пожаловать в наш интернет-магазин сыров!",
-        reply_markup=main_menu(is_admin=is_admin),
+        reply_markup=main_menu(
+            manage_catalog=shop.has_role(message.from_user.id, 'catalog'),
+            handle_orders=shop.has_role(message.from_user.id, 'orders'),
+        ),
         parse_mode='HTML'
     )
-    logger.info(f"Пользователь {message.from_user.id} запустил бота.")
+    logger.info("Пользователь %s запустил бота.", message.from_user.id)
 
 
 
@@ -194,7 +1665,7 @@ async def send_welcome(message: types.Message):
 @dp.message(F.text == "Каталог")
 async def show_catalog(message: types.Message):
     await message.answer("Выберите сыр из списка:", reply_markup=catalog_pagination(), parse_mode='HTML')
-    logger.info(f"Пользователь {message.from_user.id} открыл каталог.")
+    logger.info("Пользователь %s открыл каталог.", message.from_user.id)
 
 
 # Обработка пагинации каталога (Вперед и Назад)
@@ -203,7 +1674,7 @@ async def navigate_catalog(callback_query: types.CallbackQuery):
     try:
         _, action, current_page = callback_query.data.split('_')
         current_page = int(current_page)
-        logger.debug(f"Навигация каталога: действие={action}, текущая страница={current_page}")
+        logger.debug("Навигация каталога: действие=%s, текущая страница=%s", action, current_page)
     except ValueError:
         await callback_query.answer("Некорректные данные пагинации.", show_alert=True)
         logger.error("Некорректные данные пагинации.")
@@ -222,34 +1693,123 @@ async def navigate_catalog(callback_query: types.CallbackQuery):
     await callback_query.message.edit_reply_markup(reply_markup=reply_markup)
 
     await callback_query.answer()
-    logger.info(f"Пользователь {callback_query.from_user.id} перешел на страницу {new_page} каталога.")
+    logger.info("Пользователь %s перешел на страницу %s каталога.", callback_query.from_user.id, new_page)
 
 # Обработка кнопки "Просмотреть заказы"
-@dp.message(F.text == "Просмотреть заказы", F.from_user.id == ADMIN_ID)
+@dp.message(F.text == "Просмотреть заказы", IsAdmin('orders'))
 async def view_orders(message: types.Message):
-    orders = get_all_orders()
+    orders, has_more = get_all_orders()
     if not orders:
         await message.answer("Нет доступных заказов.", parse_mode='HTML')
         logger.info("Администратор запросил заказы, но они отсутствуют.")
     else:
-        response = "Список заказов:\n\n"
-        for order in orders:
-            telegram_username = f"@{order['telegram_username']}" if order['telegram_username'] else "Не указан"
-            response += (
-                f"Заказ ID: {order['id']}\n"
-                f"Telegram: {telegram_username}\n"
-                f"Сыр: {order['cheese_name']}\n"
-                f"Имя клиента: {order['customer_name']}\n"
-                f"Телефон: {order['phone']}\n"
-                f"Количество: {order['quantity']} грамм\n"
-                f"Способ получения: {order['delivery_method']}\n"
-                f"Адрес: {order['address'] if order['address'] else 'Не требуется'}\n"
-                f"Время заказа: {order['timestamp']}\n\n"
-            )
-        await message.answer(response, parse_mode='HTML')
-        logger.info(f"Администратор {message.from_user.id} просмотрел список заказов.")
+        await send_order_list(message, user_locale(message.from_user), orders, has_more)
+        logger.info("Администратор %s просмотрел список заказов.", message.from_user.id)
+
+
+# Следующая страница списка заказов администратора
+@dp.callback_query(F.data.startswith("allorders_"), IsAdmin('orders'))
+async def view_orders_more(callback_query: types.CallbackQuery):
+    try:
+        before_id = int(callback_query.data.split('_')[1])
+    except (IndexError, ValueError):
+        await callback_query.answer("Некорректные данные пагинации.", show_alert=True)
+        logger.error("Некорректные данные пагинации списка заказов.")
+        return
+
+    orders, has_more = get_all_orders(before_id=before_id)
+    if orders:
+        await send_order_list(callback_query.message, user_locale(callback_query.from_user), orders, has_more)
+    await callback_query.answer()
+    logger.info("Администратор %s листает список заказов до ID=%s.", callback_query.from_user.id, before_id)
+
+
+# Страница списка заказов: обычно одно сообщение, кнопка «Ранее» под последним
+async def send_order_list(message, locale, orders, has_more):
+    chunks = render_order_list(locale, orders)
+    for n, response in enumerate(chunks, 1):
+        await message.answer(
+            response,
+            reply_markup=all_orders_keyboard(orders, has_more) if n == len(chunks) else None,
+            parse_mode='HTML'
+        )
+
+# Обработка кнопок смены статуса заказа
+@dp.callback_query(F.data.startswith("ostatus_"), IsAdmin('orders'))
+async def change_order_status(callback_query: types.CallbackQuery):
+    try:
+        _, status, order_id = callback_query.data.split('_')
+        order_id = int(order_id)
+        label = ORDER_STATUSES[status]
+    except (KeyError, ValueError):
+        await callback_query.answer("Некорректные данные статуса.", show_alert=True)
+        logger.error("Некорректные данные статуса заказа: %s", callback_query.data)
+        return
+
+    result = set_order_status(order_id, status)
+    if result is None:
+        await callback_query.answer("Заказ не найден.", show_alert=True)
+        logger.warning("Заказ ID=%s не найден при смене статуса.", order_id)
+        return
+
+    user_id, previous_status, locale = result
+    if previous_status == status:
+        # Клавиатура уже отмечает этот статус: Telegram отклонил бы правку без изменений
+        await callback_query.answer(f"Статус уже установлен: {label}")
+        return
+
+    await callback_query.message.edit_reply_markup(reply_markup=order_status_keyboard(order_id, status))
+    await callback_query.answer(f"Статус заказа: {label}")
+    run_in_background(refresh_order_notifications(
+        current_shop.get(), order_id, status, skip_chat_id=callback_query.message.chat.id
+    ))
+    logger.info("Администратор %s изменил статус заказа ID=%s на %s.", callback_query.from_user.id, order_id, status)
+
+    try:
+        await callback_query.bot.send_message(
+            user_id,
+            render(locale, 'status_changed', order_id=order_id, status=status_label(locale, status)),
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        logger.error("Не удалось уведомить пользователя %s о смене статуса заказа: %s", user_id, e)
 
-@dp.message(F.text == "Удалить сыр", F.from_user.id == ADMIN_ID)
+
+# Обработка кнопки "Мои заказы"
+@dp.message(F.text == "Мои заказы")
+async def my_orders(message: types.Message):
+    orders, has_more = get_user_orders(message.from_user.id)
+    if not orders:
+        await message.answer("У вас пока нет заказов.", parse_mode='HTML')
+    else:
+        await message.answer(
+            format_user_orders(user_locale(message.from_user), orders),
+            reply_markup=my_orders_keyboard(orders, has_more), parse_mode='HTML'
+        )
+    logger.info("Пользователь %s открыл историю заказов.", message.from_user.id)
+
+
+# Следующая страница истории заказов
+@dp.callback_query(F.data.startswith("myorders_"))
+async def my_orders_more(callback_query: types.CallbackQuery):
+    try:
+        before_id = int(callback_query.data.split('_')[1])
+    except (IndexError, ValueError):
+        await callback_query.answer("Некорректные данные пагинации.", show_alert=True)
+        logger.error("Некорректные данные пагинации истории заказов.")
+        return
+
+    orders, has_more = get_user_orders(callback_query.from_user.id, before_id=before_id)
+    if orders:
+        await callback_query.message.answer(
+            format_user_orders(user_locale(callback_query.from_user), orders),
+            reply_markup=my_orders_keyboard(orders, has_more), parse_mode='HTML'
+        )
+    await callback_query.answer()
+    logger.info("Пользователь %s листает историю заказов до ID=%s.", callback_query.from_user.id, before_id)
+
+
+@dp.message(F.text == "Удалить сыр", IsAdmin('catalog'))
 async def delete_cheese_button(message: types.Message, state: FSMContext):
     await list_cheeses_for_deletion(message, state)
 
@@ -261,21 +1821,35 @@ async def delete_cheese_button(message: types.Message, state: FSMContext):
 async def cheese_info(callback_query: types.CallbackQuery):
     try:
         cheese_id = int(callback_query.data.split('_')[1])
-        logger.debug(f"Информация о сыре с ID={cheese_id} запрошена.")
+        logger.debug("Информация о сыре с ID=%s запрошена.", cheese_id)
     except (IndexError, ValueError):
         await callback_query.answer("Некорректный ID сыра.", show_alert=True)
         logger.error("Некорректный ID сыра.")
         return
 
-    conn = sqlite3.connect('cheese_shop.db')
+    conn = db_connect()
     cursor = conn.cursor()
-    cursor.execute("SELECT name, description, price, photo FROM cheeses WHERE id = ?", (cheese_id,))
+    cursor.execute(
+        "SELECT name, description, price, photo FROM cheeses WHERE id = ? AND deleted_at IS NULL",
+        (cheese_id,)
+    )
     cheese = cursor.fetchone()
+
+    # Сыры, которые покупают вместе с этим; удаленные из каталога отсеиваем
+    recommended = []
+    recommended_ids = current_shop.get().recommender.recommend(cheese_id)
+    if cheese and recommended_ids:
+        cursor.execute(
+            f"SELECT id, name FROM cheeses WHERE id IN ({','.join('?' * len(recommended_ids))}) AND deleted_at IS NULL",
+            recommended_ids
+        )
+        names = dict(cursor.fetchall())
+        recommended = [(other_id, names[other_id]) for other_id in recommended_ids if other_id in names]
     conn.close()
 
     if not cheese:
         await callback_query.answer("Сыр не найден.", show_alert=True)
-        logger.warning(f"Сыр с ID={cheese_id} не найден.")
+        logger.warning("Сыр с ID=%s не найден.", cheese_id)
         return
 
     builder = InlineKeyboardBuilder()
@@ -283,16 +1857,36 @@ async def cheese_info(callback_query: types.CallbackQuery):
         InlineKeyboardButton(text="Заказать", callback_data=f"order_{cheese_id}"),
         InlineKeyboardButton(text="Назад", callback_data="back_to_catalog")
     )
+    for other_id, other_name in recommended:
+        builder.row(InlineKeyboardButton(text=f"👍 {other_name}", callback_data=f"cheese_{other_id}"))
 
-    await bot.send_photo(
+    await callback_query.bot.send_photo(
         chat_id=callback_query.from_user.id,
         photo=cheese[3],
-        caption=f"<b>{cheese[0]}</b>\n\n{cheese[1]}\n\nЦена за 100г: {cheese[2]} LKR.",
+        caption=render(
+            user_locale(callback_query.from_user), 'cheese_caption',
+            name=cheese[0], description=cheese[1], price=cheese[2]
+        ),
         reply_markup=builder.as_markup(),
         parse_mode='HTML'
     )
     await callback_query.answer()
-    logger.info(f"Пользователь {callback_query.from_user.id} просматривает сыр {cheese[0]} (ID={cheese_id}).")
+    logger.info("Пользователь %s просматривает сыр %s (ID=%s).", callback_query.from_user.id, cheese[0], cheese_id)
+
+
+# Каталог по популярности
+@dp.callback_query(F.data.startswith("popular_"))
+async def show_popular(callback_query: types.CallbackQuery):
+    try:
+        page = int(callback_query.data.split('_')[1])
+    except (IndexError, ValueError):
+        await callback_query.answer("Некорректные данные пагинации.", show_alert=True)
+        logger.error("Некорректные данные пагинации популярного.")
+        return
+
+    await callback_query.message.edit_reply_markup(reply_markup=popular_pagination(page=page))
+    await callback_query.answer()
+    logger.info("Пользователь %s открыл страницу %s популярного.", callback_query.from_user.id, page)
 
 
 # Обработка нажатия кнопки "Назад" при выборе сыра
@@ -303,11 +1897,11 @@ async def go_back_to_catalog(callback_query: types.CallbackQuery):
         await callback_query.message.delete()
         logger.debug("Сообщение с информацией о сыре удалено.")
     except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение: {e}")
+        logger.warning("Не удалось удалить сообщение: %s", e)
 
     await callback_query.message.answer("Выберите сыр из списка:", reply_markup=catalog_pagination(), parse_mode='HTML')
     await callback_query.answer()
-    logger.info(f"Пользователь {callback_query.from_user.id} вернулся в каталог.")
+    logger.info("Пользователь %s вернулся в каталог.", callback_query.from_user.id)
 
 
 # Обработка заказа
@@ -315,16 +1909,22 @@ async def go_back_to_catalog(callback_query: types.CallbackQuery):
 async def order_cheese(callback_query: types.CallbackQuery, state: FSMContext):
     try:
         cheese_id = int(callback_query.data.split('_')[1])
-        logger.debug(f"Пользователь {callback_query.from_user.id} заказал сыр с ID={cheese_id}.")
+        logger.debug("Пользователь %s заказал сыр с ID=%s.", callback_query.from_user.id, cheese_id)
     except (IndexError, ValueError):
         await callback_query.answer("Некорректный ID заказа.", show_alert=True)
         logger.error("Некорректный ID заказа.")
         return
 
+    # Карточка могла быть отправлена до удаления сыра из каталога
+    if not cheese_available(cheese_id):
+        await callback_query.answer("Этого сыра больше нет в каталоге.", show_alert=True)
+        logger.warning("Пользователь %s пытался заказать удаленный сыр ID=%s.", callback_query.from_user.id, cheese_id)
+        return
+
     # Сохраняем ID выбранного сыра
     await state.update_data(cheese_id=cheese_id)
     await state.set_state(OrderForm.name)
-    await bot.send_message(callback_query.from_user.id, "Введите ваше имя:", reply_markup=cancel_order_keyboard(), parse_mode='HTML')
+    await callback_query.bot.send_message(callback_query.from_user.id, "Введите ваше имя:", reply_markup=cancel_order_keyboard(), parse_mode='HTML')
     await callback_query.answer()
 
 
@@ -336,10 +1936,10 @@ async def process_name(message: types.Message, state: FSMContext):
         await state.update_data(name=name)
         await state.set_state(OrderForm.phone)
         await message.answer("Введите ваш телефон:", reply_markup=cancel_order_keyboard(), parse_mode='HTML')
-        logger.info(f"Пользователь {message.from_user.id} ввел имя: {name}")
+        logger.info("Пользователь %s ввел имя: %s", message.from_user.id, Redacted(name))
     else:
         await message.answer("Пожалуйста, введите ваше имя.", reply_markup=cancel_order_keyboard(), parse_mode='HTML')
-        logger.warning(f"Пользователь {message.from_user.id} попытался ввести пустое имя.")
+        logger.warning("Пользователь %s попытался ввести пустое имя.", message.from_user.id)
 
 
 # Обработка телефона
@@ -350,14 +1950,14 @@ async def process_phone(message: types.Message, state: FSMContext):
         await state.update_data(phone=phone)
         await state.set_state(OrderForm.quantity)
         await message.answer("Введите количество грамм сыра (от 100 до 2000 грамм, кратно 100):", reply_markup=cancel_order_keyboard(), parse_mode='HTML')
-        logger.info(f"Пользователь {message.from_user.id} ввел телефон: {phone}")
+        logger.info("Пользователь %s ввел телефон: %s", message.from_user.id, Redacted(phone))
     else:
         await message.answer("Пожалуйста, введите ваш телефон.", reply_markup=cancel_order_keyboard(), parse_mode='HTML')
-        logger.warning(f"Пользователь {message.from_user.id} попытался ввести пустой телефон.")
+        logger.warning("Пользователь %s попытался ввести пустой телефон.", message.from_user.id)
 
 
 # Обработка адреса доставки
-@dp.message(StateFilter(OrderForm.address), F.from_user.id != ADMIN_ID)
+@dp.message(StateFilter(OrderForm.address))
 async def process_address(message: types.Message, state: FSMContext):
     address = message.text.strip()
     if address:
@@ -365,18 +1965,27 @@ async def process_address(message: types.Message, state: FSMContext):
         # Получаем Telegram-ник пользователя
         telegram_username = message.from_user.username
         # Сохранение заказа с адресом
-        save_order(
-            user_id=message.from_user.id,
-            telegram_username=telegram_username,
-            cheese_id=user_data['cheese_id'],
-            name=user_data['name'],
-            phone=user_data['phone'],
-            quantity=user_data['quantity'],
-            delivery_method="Доставка",
-            address=address
-        )
-
-        await notify_admin({
+        try:
+            order_id = save_order(
+                user_id=message.from_user.id,
+                telegram_username=telegram_username,
+                cheese_id=user_data['cheese_id'],
+                name=user_data['name'],
+                phone=user_data['phone'],
+                quantity=user_data['quantity'],
+                delivery_method="Доставка",
+                address=address,
+                locale=user_locale(message.from_user)
+            )
+        except sqlite3.OperationalError as e:
+            # База занята (например, обслуживанием): анкета не сбрасывается, покупатель повторит шаг
+            locale = user_locale(message.from_user)
+            await message.answer(render(locale, 'order_save_failed'), reply_markup=cancel_order_keyboard(), parse_mode='HTML')
+            logger.error("Не удалось сохранить заказ пользователя %s: %s", message.from_user.id, e)
+            return
+
+        order = {
+            'order_id': order_id,
             'name': user_data['name'],
             'telegram_username': telegram_username,
             'phone': user_data['phone'],
@@ -384,21 +1993,21 @@ async def process_address(message: types.Message, state: FSMContext):
             'delivery_method': "Доставка",
             'address': address,
             'cheese_id': user_data['cheese_id']
-        })
+        }
+        # Уведомления администраторам уходят в фоне: покупатель не ждет рассылки
+        run_in_background(notify_admin(order))
 
+        locale = user_locale(message.from_user)
         await message.answer(
-            f"Спасибо за заказ, {user_data['name']}!\n\n"
-            f"Телефон: {user_data['phone']}\n"
-            f"Количество: {user_data['quantity']} грамм\n"
-            f"Способ получения: Доставка\n"
-            f"Адрес: {address}", reply_markup=cancel_order_keyboard(),
+            render(locale, 'order_thanks', **order_fields(locale, order)),
+            reply_markup=cancel_order_keyboard(),
             parse_mode='HTML'
         )
         await state.clear()
-        logger.info(f"Заказ пользователя {message.from_user.id} завершен и сохранён с адресом: {address}.")
+        logger.info("Заказ пользователя %s завершен и сохранён с адресом: %s.", message.from_user.id, Redacted(address))
     else:
         await message.answer("Пожалуйста, введите корректный адрес для доставки.", reply_markup=cancel_order_keyboard(), parse_mode='HTML')
-        logger.warning(f"Пользователь {message.from_user.id} попытался ввести пустой адрес.")
+        logger.warning("Пользователь %s попытался ввести пустой адрес.", message.from_user.id)
 
 
 # Обработка количества грамм сыра
@@ -415,13 +2024,13 @@ async def process_quantity(message: types.Message, state: FSMContext):
             )
             await state.set_state(OrderForm.delivery)
             await message.answer("Выберите способ получения:", reply_markup=builder.as_markup(), parse_mode='HTML')
-            logger.info(f"Пользователь {message.from_user.id} выбрал количество: {quantity} грамм.")
+            logger.info("Пользователь %s выбрал количество: %s грамм.", message.from_user.id, quantity)
         else:
             await message.answer("Пожалуйста, введите количество грамм сыра от 100 до 2000, кратное 100.", parse_mode='HTML')
-            logger.warning(f"Пользователь {message.from_user.id} ввел некорректное количество: {message.text}")
+            logger.warning("Пользователь %s ввел некорректное количество: %s", message.from_user.id, message.text)
     except ValueError:
         await message.answer("Пожалуйста, введите корректное число (например, 500).", parse_mode='HTML')
-        logger.warning(f"Пользователь {message.from_user.id} ввел нечисловое значение для количества: {message.text}")
+        logger.warning("Пользователь %s ввел нечисловое значение для количества: %s", message.from_user.id, message.text)
 
 
 
@@ -430,92 +2039,101 @@ async def process_quantity(message: types.Message, state: FSMContext):
 async def process_delivery(callback_query: types.CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
     delivery_method = "Самовывоз" if callback_query.data == 'pickup' else "Доставка"
-    logger.info(f"Пользователь {callback_query.from_user.id} выбрал способ получения: {delivery_method}")
+    logger.info("Пользователь %s выбрал способ получения: %s", callback_query.from_user.id, delivery_method)
 
     if delivery_method == "Самовывоз":
         # Получаем Telegram-ник пользователя
         telegram_username = callback_query.from_user.username
         # Сохранение заказа без адреса
-        save_order(
-            user_id=callback_query.from_user.id,
-            telegram_username=telegram_username,
-            cheese_id=user_data['cheese_id'],
-            name=user_data['name'],
-            phone=user_data['phone'],
-            quantity=user_data['quantity'],
-            delivery_method=delivery_method,
-            address=None  # Адрес не требуется
-        )
-
-        await notify_admin({
+        try:
+            order_id = save_order(
+                user_id=callback_query.from_user.id,
+                telegram_username=telegram_username,
+                cheese_id=user_data['cheese_id'],
+                name=user_data['name'],
+                phone=user_data['phone'],
+                quantity=user_data['quantity'],
+                delivery_method=delivery_method,
+                address=None,  # Адрес не требуется
+                locale=user_locale(callback_query.from_user)
+            )
+        except sqlite3.OperationalError as e:
+            # База занята (например, обслуживанием): анкета не сбрасывается, покупатель повторит шаг
+            locale = user_locale(callback_query.from_user)
+            await callback_query.answer(render(locale, 'order_save_failed'), show_alert=True)
+            logger.error("Не удалось сохранить заказ пользователя %s: %s", callback_query.from_user.id, e)
+            return
+
+        order = {
+            'order_id': order_id,
             'name': user_data['name'],
             'telegram_username': telegram_username,
             'phone': user_data['phone'],
             'quantity': user_data['quantity'],
-            'delivery_method': "Самовывоз",
-            'address': "Самовывоз",
+            'delivery_method': delivery_method,
+            'address': None,
             'cheese_id': user_data['cheese_id']
-        })
+        }
+        # Уведомления администраторам уходят в фоне: покупатель не ждет рассылки
+        run_in_background(notify_admin(order))
 
-        await bot.send_message(
+        locale = user_locale(callback_query.from_user)
+        await callback_query.bot.send_message(
             callback_query.from_user.id,
-            f"Спасибо за заказ, {user_data['name']}!\n\n"
-            f"Телефон: {user_data['phone']}\n"
-            f"Количество: {user_data['quantity']} грамм\n"
-            f"Способ получения: {delivery_method}",
+            render(locale, 'order_thanks', **order_fields(locale, order)),
             parse_mode='HTML'
         )
         await state.clear()
         await callback_query.answer()
-        logger.info(f"Заказ пользователя {callback_query.from_user.id} завершен и сохранён без адреса.")
+        logger.info("Заказ пользователя %s завершен и сохранён без адреса.", callback_query.from_user.id)
     else:
         # Переходим к вводу адреса
         await state.set_state(OrderForm.address)
-        await bot.send_message(
+        await callback_query.bot.send_message(
             callback_query.from_user.id,
             "Введите ваш адрес для доставки:", reply_markup=cancel_order_keyboard(),
             parse_mode='HTML'
         )
         await callback_query.answer()
-        logger.info(f"Пользователь {callback_query.from_user.id} выбрал доставку и должен ввести адрес.")
+        logger.info("Пользователь %s выбрал доставку и должен ввести адрес.", callback_query.from_user.id)
 
 
 
 # Админка для добавления сыра
-@dp.message(Command("add_cheese"), F.from_user.id == ADMIN_ID)
+@dp.message(Command("add_cheese"), IsAdmin('catalog'))
 async def add_cheese(message: types.Message, state: FSMContext):
     await state.set_state(AddCheeseForm.name)
     await message.answer("Введите название сыра:", parse_mode='HTML')
-    logger.info(f"Администратор {message.from_user.id} начал добавление нового сыра.")
+    logger.info("Администратор %s начал добавление нового сыра.", message.from_user.id)
 
 
-@dp.message(StateFilter(AddCheeseForm.name), F.from_user.id == ADMIN_ID)
+@dp.message(StateFilter(AddCheeseForm.name), IsAdmin('catalog'))
 async def process_cheese_name(message: types.Message, state: FSMContext):
     name = message.text.strip()
     if name:
         await state.update_data(name=name)
         await state.set_state(AddCheeseForm.description)
         await message.answer("Введите описание сыра:", parse_mode='HTML')
-        logger.info(f"Администратор {message.from_user.id} ввел название сыра: {name}")
+        logger.info("Администратор %s ввел название сыра: %s", message.from_user.id, name)
     else:
         await message.answer("Пожалуйста, введите название сыра.", parse_mode='HTML')
-        logger.warning(f"Администратор {message.from_user.id} попытался ввести пустое название.")
+        logger.warning("Администратор %s попытался ввести пустое название.", message.from_user.id)
 
 
-@dp.message(StateFilter(AddCheeseForm.description), F.from_user.id == ADMIN_ID)
+@dp.message(StateFilter(AddCheeseForm.description), IsAdmin('catalog'))
 async def process_cheese_description(message: types.Message, state: FSMContext):
     description = message.text.strip()
     if description:
         await state.update_data(description=description)
         await state.set_state(AddCheeseForm.price)
         await message.answer("Введите цену за 100 грамм:", parse_mode='HTML')
-        logger.info(f"Администратор {message.from_user.id} ввел описание сыра: {description}")
+        logger.info("Администратор %s ввел описание сыра: %s", message.from_user.id, description)
     else:
         await message.answer("Пожалуйста, введите описание сыра.", parse_mode='HTML')
-        logger.warning(f"Администратор {message.from_user.id} попытался ввести пустое описание.")
+        logger.warning("Администратор %s попытался ввести пустое описание.", message.from_user.id)
 
 
-@dp.message(StateFilter(AddCheeseForm.price), F.from_user.id == ADMIN_ID)
+@dp.message(StateFilter(AddCheeseForm.price), IsAdmin('catalog'))
 async def process_cheese_price(message: types.Message, state: FSMContext):
     try:
         price = float(message.text.replace(',', '.'))
@@ -523,23 +2141,23 @@ async def process_cheese_price(message: types.Message, state: FSMContext):
             await state.update_data(price=price)
             await state.set_state(AddCheeseForm.photo)
             await message.answer("Отправьте фотографию сыра:", parse_mode='HTML')
-            logger.info(f"Администратор {message.from_user.id} ввел цену: {price}")
+            logger.info("Администратор %s ввел цену: %s", message.from_user.id, price)
         else:
             await message.answer("Цена должна быть положительным числом. Попробуйте еще раз.", parse_mode='HTML')
-            logger.warning(f"Администратор {message.from_user.id} ввел отрицательную цену: {message.text}")
+            logger.warning("Администратор %s ввел отрицательную цену: %s", message.from_user.id, message.text)
     except ValueError:
         await message.answer("Введите корректную цену (число). Попробуйте еще раз.", parse_mode='HTML')
-        logger.warning(f"Администратор {message.from_user.id} ввел некорректную цену: {message.text}")
+        logger.warning("Администратор %s ввел некорректную цену: %s", message.from_user.id, message.text)
 
 
-@dp.message(StateFilter(AddCheeseForm.photo), F.from_user.id == ADMIN_ID, F.content_type == ContentType.PHOTO)
+@dp.message(StateFilter(AddCheeseForm.photo), IsAdmin('catalog'), F.content_type == ContentType.PHOTO)
 async def process_cheese_photo(message: types.Message, state: FSMContext):
     photo_file_id = message.photo[-1].file_id
     data = await state.get_data()
-    logger.debug(f"Администратор {message.from_user.id} отправил фотографию для сыра: {photo_file_id}")
+    logger.debug("Администратор %s отправил фотографию для сыра: %s", message.from_user.id, photo_file_id)
 
     # Сохранение данных в базу
-    conn = sqlite3.connect('cheese_shop.db')
+    conn = db_connect()
     cursor = conn.cursor()
     cursor.execute(
         "INSERT INTO cheeses (name, description, price, photo) VALUES (?, ?, ?, ?)",
@@ -547,155 +2165,382 @@ async def process_cheese_photo(message: types.Message, state: FSMContext):
     )
     conn.commit()
     conn.close()
+    invalidate_catalog()
 
     await state.clear()
     await message.answer("Сыр успешно добавлен!", parse_mode='HTML')
-    logger.info(f"Администратор {message.from_user.id} добавил новый сыр: {data['name']}")
+    logger.info("Администратор %s добавил новый сыр: %s", message.from_user.id, data['name'])
 
 
 # Админка для редактирования сыра
-@dp.message(Command("edit_cheese"), F.from_user.id == ADMIN_ID)
-async def edit_cheese(message: types.Message, state: FSMContext):
-    # Показываем список сыров
-    conn = sqlite3.connect('cheese_shop.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM cheeses")
-    cheeses = cursor.fetchall()
-    conn.close()
+@dp.message(Command("edit_cheese"), IsAdmin('catalog'))
+async def edit_cheese(message: types.Message, state: FSMContext, command: CommandObject):
+    # Текст после команды используется как поисковый запрос: /edit_cheese гауда
+    # (CommandObject отделяет и упоминание бота: /edit_cheese@shop_bot гауда)
+    query = command.args.strip() if command.args else None
+    await show_edit_picker(message, state, query or None)
+
 
-    if not cheeses:
-        await message.answer("Нет доступных сыров для редактирования.", parse_mode='HTML')
-        logger.info("Администратор попытался редактировать сыр, но база пустая.")
+async def show_edit_picker(message: types.Message, state: FSMContext, query=None):
+    await state.set_state(None)
+    await state.update_data(edit_query=query)
+
+    if not get_cheeses(limit=1, query=query):
+        if query:
+            await message.answer(f"По запросу «{query}» сыров не найдено.", reply_markup=edit_search_keyboard())
+        else:
+            await message.answer("Нет доступных сыров для редактирования.", parse_mode='HTML')
+        logger.info("Администратор %s не нашел сыров для редактирования (запрос: %s).", message.from_user.id, query)
         return
 
-    # Создаем inline-кнопки для выбора сыра
-    builder = InlineKeyboardBuilder()
-    for cheese in cheeses:
-        builder.add(InlineKeyboardButton(text=cheese[1], callback_data=f"edit_cheese_{cheese[0]}"))
+    await message.answer("Выберите сыр для редактирования:", reply_markup=edit_pagination(query=query))
+    logger.info("Администратор %s начал редактирование сыра (запрос: %s).", message.from_user.id, query)
+
+
+# Обработка пагинации списка сыров для редактирования
+@dp.callback_query(F.data.startswith("editpage_"), IsAdmin('catalog'))
+async def navigate_edit_catalog(callback_query: types.CallbackQuery, state: FSMContext):
+    try:
+        page = int(callback_query.data.split('_')[1])
+    except (IndexError, ValueError):
+        await callback_query.answer("Некорректные данные пагинации.", show_alert=True)
+        logger.error("Некорректные данные пагинации редактирования.")
+        return
+
+    data = await state.get_data()
+    reply_markup = edit_pagination(page=page, query=data.get('edit_query'))
+    await callback_query.message.edit_reply_markup(reply_markup=reply_markup)
+    await callback_query.answer()
+    logger.info("Администратор %s перешел на страницу %s редактирования.", callback_query.from_user.id, page)
+
 
-    await message.answer("Выберите сыр для редактирования:", reply_markup=builder.as_markup(), parse_mode='HTML')
-    logger.info(f"Администратор {message.from_user.id} начал редактирование сыра.")
+# Поиск сыра для редактирования по названию
+@dp.callback_query(F.data == "edit_search", IsAdmin('catalog'))
+async def start_edit_search(callback_query: types.CallbackQuery, state: FSMContext):
+    await state.set_state(EditCheeseForm.search)
+    await callback_query.message.answer("Введите часть названия сыра:", parse_mode='HTML')
+    await callback_query.answer()
+
+
+@dp.message(StateFilter(EditCheeseForm.search), IsAdmin('catalog'))
+async def process_edit_search(message: types.Message, state: FSMContext):
+    query = (message.text or '').strip()
+    if not query:
+        await message.answer("Пожалуйста, введите часть названия сыра.", parse_mode='HTML')
+        return
+    await show_edit_picker(message, state, query)
 
 
 # Обработка выбора сыра для редактирования
-@dp.callback_query(F.data.startswith('edit_cheese_'), F.from_user.id == ADMIN_ID)
+@dp.callback_query(F.data.startswith('edit_cheese_'), IsAdmin('catalog'))
 async def choose_cheese_for_edit(callback_query: types.CallbackQuery, state: FSMContext):
     try:
         cheese_id = int(callback_query.data.split('_')[-1])
-        logger.debug(f"Администратор {callback_query.from_user.id} выбрал для редактирования сыр с ID={cheese_id}.")
+        logger.debug("Администратор %s выбрал для редактирования сыр с ID=%s.", callback_query.from_user.id, cheese_id)
     except (IndexError, ValueError):
         await callback_query.answer("Некорректный ID сыра.", show_alert=True)
         logger.error("Некорректный ID сыра при редактировании.")
         return
 
-    await state.update_data(edit_cheese_id=cheese_id)
-
     # Получаем данные о выбранном сыра
-    conn = sqlite3.connect('cheese_shop.db')
+    conn = db_connect()
     cursor = conn.cursor()
-    cursor.execute("SELECT name, description, price FROM cheeses WHERE id = ?", (cheese_id,))
+    cursor.execute("SELECT name, description, price FROM cheeses WHERE id = ? AND deleted_at IS NULL", (cheese_id,))
     cheese = cursor.fetchone()
     conn.close()
 
     if not cheese:
         await callback_query.answer("Сыр не найден.", show_alert=True)
-        logger.warning(f"Сыр с ID={cheese_id} не найден при редактировании.")
+        logger.warning("Сыр с ID=%s не найден при редактировании.", cheese_id)
         return
 
+    await state.set_state(None)
+    await state.update_data(edit_cheese_id=cheese_id)
     await callback_query.message.answer(
         f"Текущие данные:\n"
         f"Название: {cheese[0]}\n"
         f"Описание: {cheese[1]}\n"
-        f"Цена за 100 г: {cheese[2]}"
-    )
-    await callback_query.message.answer(
-        "Введите новое название сыра (или отправьте текущее, если не хотите изменять):",
-        parse_mode='HTML'
+        f"Цена за 100 г: {cheese[2]}\n\n"
+        f"Что изменить?",
+        reply_markup=edit_fields_keyboard(cheese_id)
     )
+    await callback_query.answer()
+    logger.info("Администратор %s выбрал сыр с ID=%s для редактирования.", callback_query.from_user.id, cheese_id)
+
 
-    await state.set_state(EditCheeseForm.name)
+# Выбор поля для редактирования
+@dp.callback_query(F.data.startswith('edit_field_'), IsAdmin('catalog'))
+async def choose_field_for_edit(callback_query: types.CallbackQuery, state: FSMContext):
+    try:
+        _, _, field, cheese_id = callback_query.data.split('_')
+        cheese_id = int(cheese_id)
+        next_state, prompt = EDIT_FIELD_PROMPTS[field]
+    except (KeyError, ValueError):
+        await callback_query.answer("Некорректные данные редактирования.", show_alert=True)
+        logger.error("Некорректные данные редактирования: %s", callback_query.data)
+        return
+
+    await state.update_data(edit_cheese_id=cheese_id)
+    await state.set_state(next_state)
+    await callback_query.message.answer(prompt, parse_mode='HTML')
     await callback_query.answer()
-    logger.info(f"Администратор {callback_query.from_user.id} начал изменение названия сыра с ID={cheese_id}.")
+    logger.info("Администратор %s изменяет поле %s сыра с ID=%s.", callback_query.from_user.id, field, cheese_id)
+
+
+async def finish_field_edit(message: types.Message, state: FSMContext, field, value):
+    data = await state.get_data()
+    cheese_id = data.get('edit_cheese_id')
+    await state.set_state(None)
 
+    if not cheese_id or not update_cheese_field(cheese_id, field, value):
+        await message.answer("Сыр не найден.", parse_mode='HTML')
+        logger.warning("Сыр с ID=%s не найден при изменении поля %s.", cheese_id, field)
+        return
 
-# Продолжаем процесс редактирования сыра
-@dp.message(StateFilter(EditCheeseForm.name), F.from_user.id == ADMIN_ID)
+    await message.answer(
+        "Данные сыра успешно обновлены! Изменить что-то еще?",
+        reply_markup=edit_fields_keyboard(cheese_id)
+    )
+    logger.info("Администратор %s изменил поле %s сыра с ID=%s.", message.from_user.id, field, cheese_id)
+
+
+@dp.message(StateFilter(EditCheeseForm.name), IsAdmin('catalog'))
 async def process_edit_cheese_name(message: types.Message, state: FSMContext):
-    name = message.text.strip()
+    name = (message.text or '').strip()
     if name:
-        await state.update_data(name=name)
-        await state.set_state(EditCheeseForm.description)
-        await message.answer("Введите новое описание сыра:", parse_mode='HTML')
-        logger.info(f"Администратор {message.from_user.id} изменил название сыра на: {name}")
+        await finish_field_edit(message, state, 'name', name)
     else:
         await message.answer("Пожалуйста, введите название сыра.", parse_mode='HTML')
-        logger.warning(f"Администратор {message.from_user.id} попытался ввести пустое название.")
-
+        logger.warning("Администратор %s попытался ввести пустое название.", message.from_user.id)
 
 
-@dp.message(StateFilter(EditCheeseForm.description), F.from_user.id == ADMIN_ID)
+@dp.message(StateFilter(EditCheeseForm.description), IsAdmin('catalog'))
 async def process_edit_cheese_description(message: types.Message, state: FSMContext):
-    description = message.text.strip()
+    description = (message.text or '').strip()
     if description:
-        await state.update_data(description=description)
-        await state.set_state(EditCheeseForm.price)
-        await message.answer("Введите новую цену за 100 грамм:", parse_mode='HTML')
-        logger.info(f"Администратор {message.from_user.id} изменил описание сыра на: {description}")
+        await finish_field_edit(message, state, 'description', description)
     else:
         await message.answer("Пожалуйста, введите описание сыра.", parse_mode='HTML')
-        logger.warning(f"Администратор {message.from_user.id} попытался ввести пустое описание.")
+        logger.warning("Администратор %s попытался ввести пустое описание.", message.from_user.id)
 
 
-@dp.message(StateFilter(EditCheeseForm.price), F.from_user.id == ADMIN_ID)
+@dp.message(StateFilter(EditCheeseForm.price), IsAdmin('catalog'))
 async def process_edit_cheese_price(message: types.Message, state: FSMContext):
     try:
-        price = float(message.text.replace(',', '.'))
+        price = float((message.text or '').replace(',', '.'))
         if price > 0:
-            await state.update_data(price=price)
-            await state.set_state(EditCheeseForm.photo)
-            await message.answer("Отправьте новую фотографию сыра (или отправьте /skip для пропуска):", parse_mode='HTML')
-            logger.info(f"Администратор {message.from_user.id} ввел новую цену: {price}")
+            await finish_field_edit(message, state, 'price', price)
         else:
             await message.answer("Цена должна быть положительным числом. Попробуйте ещё раз.", parse_mode='HTML')
-            logger.warning(f"Администратор {message.from_user.id} ввел отрицательную цену: {message.text}")
+            logger.warning("Администратор %s ввел отрицательную цену: %s", message.from_user.id, message.text)
     except ValueError:
         await message.answer("Введите корректную цену (число). Попробуйте ещё раз.", parse_mode='HTML')
-        logger.warning(f"Администратор {message.from_user.id} ввел некорректную цену: {message.text}")
+        logger.warning("Администратор %s ввел некорректную цену: %s", message.from_user.id, message.text)
 
 
-@dp.message(StateFilter(EditCheeseForm.photo), F.from_user.id == ADMIN_ID, F.content_type == ContentType.PHOTO)
+@dp.message(StateFilter(EditCheeseForm.photo), IsAdmin('catalog'), F.content_type == ContentType.PHOTO)
 async def process_edit_cheese_photo(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    cheese_id = data.get('edit_cheese_id')
-    if not cheese_id:
-        await message.answer("Ошибка: ID сыра не найден.", parse_mode='HTML')
-        logger.error("ID сыра не найден в состоянии при обновлении фото.")
-        await state.clear()
+    photo_file_id = message.photo[-1].file_id
+    logger.debug("Администратор %s отправил новую фотографию сыра: %s", message.from_user.id, photo_file_id)
+    await finish_field_edit(message, state, 'photo', photo_file_id)
+
+
+# Состояние бота: задержки цикла событий и последние зависания
+@dp.message(Command("health"), IsAdmin())
+async def health_command(message: types.Message):
+    # Общие для процесса показатели цикла событий и только свои зависания и нагрузка:
+    # администраторы одного магазина не должны видеть апдейты и покупателей другого
+    shop = current_shop.get()
+    report = watchdog.report()
+    usage = shop.usage_report()
+    stalls_by_handler = watchdog.stalls_by_shop.get(shop.name, Counter())
+    recent_stalls = [stall for stall in watchdog.stalls if stall['shop'] == shop.name][-5:]
+    lines = [
+        f"Аптайм: {report['uptime_s'] // 3600} ч {report['uptime_s'] % 3600 // 60} мин",
+        f"Задержка цикла, мс: сейчас {report['loop_lag_ms']['last']}, "
+        f"p99 {report['loop_lag_ms']['p99']}, макс {report['loop_lag_ms']['max']}",
+        f"Логи: записей {report['logging']['records']}, в очереди {report['logging']['queued']}, "
+        f"отброшено {report['logging']['dropped']}, {report['logging']['us_per_record']} мкс на запись",
+        f"Запуск, с: импорт {report['startup']['import_s']}, готовность {report['startup']['ready_s']}, "
+        f"первый ответ {report['startup']['first_response_s']}, прогрев {report['startup']['warmup_s']}",
+        f"Магазин {shop.name}: апдейтов {usage['updates']} ({usage['handler_ms']} мс в хэндлерах), "
+        f"в обработке {len(shop.inflight)}",
+        f"  БД: запросов {usage['db_queries']}, {usage['db_ms']} мс; вызовов API: {usage['api_calls']}",
+        f"  Отложенных таймеров: {usage['pending_timers']}, страниц каталога в кэше: {usage['cached_catalog_pages']}, "
+        f"историй заказов в кэше: {usage['cached_order_histories']}, рекомендации: {usage['recommender_kb']} КБ",
+        f"Зависаний цикла в хэндлерах магазина (дольше {STALL_THRESHOLD * 1000:.0f} мс): "
+        f"{sum(stalls_by_handler.values())}",
+    ]
+    for handler_name, count in stalls_by_handler.most_common():
+        lines.append(f"  {handler_name}: {count}")
+    for stall in recent_stalls:
+        lines.append(
+            f"{stall['at']}: {stall['duration_ms']} мс, {stall['handler']} "
+            f"(апдейт {stall['update_id']}, пользователь {stall['user_id']})"
+        )
+    await message.answer("\n".join(lines))
+    logger.info("Администратор %s запросил состояние бота.", message.from_user.id)
+
+
+# Резервная копия по запросу администратора
+@dp.message(Command("backup"), IsAdmin('owner'))
+async def backup_command(message: types.Message):
+    await message.answer("Создаю резервную копию базы данных...", parse_mode='HTML')
+    try:
+        backup_path = await create_backup()
+    except Exception as e:
+        await message.answer("Не удалось создать резервную копию.", parse_mode='HTML')
+        logger.error("Ошибка при резервном копировании по запросу администратора: %s", e)
         return
 
-    photo_file_id = message.photo[-1].file_id
-    logger.debug(f"Администратор {message.from_user.id} отправил новую фотографию для сыра ID={cheese_id}.")
+    size = os.path.getsize(backup_path)
+    caption = f"Резервная копия создана: {os.path.basename(backup_path)} ({size / 1024:.0f} КБ)"
+    if size <= BACKUP_SEND_LIMIT:
+        await message.answer_document(types.FSInputFile(backup_path), caption=caption)
+    else:
+        await message.answer(caption, parse_mode='HTML')
+    logger.info("Администратор %s создал резервную копию %s.", message.from_user.id, backup_path)
+
 
-    # Обновление данных в базе данных
-    conn = sqlite3.connect('cheese_shop.db')
+# Администраторы магазина: таблица admins целиком держится в памяти магазина
+# и перечитывается после каждого изменения, так что фильтры не ходят в БД
+def load_admins():
+    conn = db_connect()
     cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE cheeses SET name = ?, description = ?, price = ?, photo = ? WHERE id = ?",
-        (data['name'], data['description'], data['price'], photo_file_id, cheese_id)
-    )
+    cursor.execute("SELECT user_id, role FROM admins")
+    admins = {}
+    for user_id, role in cursor.fetchall():
+        admins.setdefault(user_id, set()).add(role)
+    conn.close()
+    shop = current_shop.get()
+    shop.admins = {user_id: frozenset(roles) for user_id, roles in admins.items()}
+    logger.info("Магазин %s: загружено администраторов: %s.", shop.name, len(shop.admins))
+
+
+def add_admin_role(user_id, role):
+    conn = db_connect()
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR IGNORE INTO admins (user_id, role) VALUES (?, ?)", (user_id, role))
     conn.commit()
+    added = cursor.rowcount > 0
     conn.close()
+    load_admins()
+    return added
+
+
+# Снимает одну роль или, если роль не указана, все роли пользователя
+def remove_admin_role(user_id, role=None):
+    conn = db_connect()
+    cursor = conn.cursor()
+    if role:
+        cursor.execute("DELETE FROM admins WHERE user_id = ? AND role = ?", (user_id, role))
+    else:
+        cursor.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
+    conn.commit()
+    removed = cursor.rowcount
+    conn.close()
+    load_admins()
+    return removed
+
+
+# Список администраторов: /admins
+@dp.message(Command("admins"), IsAdmin('owner'))
+async def list_admins(message: types.Message):
+    shop = current_shop.get()
+    lines = ["Администраторы магазина:"]
+    for user_id, roles in sorted(shop.admins.items()):
+        lines.append(f"{user_id}: {', '.join(sorted(roles))}")
+    lines.append("")
+    lines.extend(f"{role} — {description}" for role, description in ADMIN_ROLES.items())
+    await message.answer("\n".join(lines))
+    logger.info("Администратор %s запросил список администраторов.", message.from_user.id)
+
+
+# Выдача роли: /add_admin <ID пользователя> <роль>
+@dp.message(Command("add_admin"), IsAdmin('owner'))
+async def add_admin_command(message: types.Message, command: CommandObject):
+    args = (command.args or '').split()
+    try:
+        user_id = int(args[0])
+        role = args[1]
+        if role not in ADMIN_ROLES:
+            raise ValueError
+    except (IndexError, ValueError):
+        await message.answer(
+            f"Использование: /add_admin &lt;ID пользователя&gt; &lt;роль&gt;\n"
+            f"Роли: {', '.join(ADMIN_ROLES)}",
+            parse_mode='HTML'
+        )
+        return
+
+    if add_admin_role(user_id, role):
+        await message.answer(f"Пользователю {user_id} выдана роль {role}.", parse_mode='HTML')
+    else:
+        await message.answer(f"У пользователя {user_id} уже есть роль {role}.", parse_mode='HTML')
+    logger.info("Администратор %s выдал пользователю %s роль %s.", message.from_user.id, user_id, role)
+
+
+# Снятие роли: /remove_admin <ID пользователя> [роль]
+@dp.message(Command("remove_admin"), IsAdmin('owner'))
+async def remove_admin_command(message: types.Message, command: CommandObject):
+    args = (command.args or '').split()
+    try:
+        user_id = int(args[0])
+        role = args[1] if len(args) > 1 else None
+        if role is not None and role not in ADMIN_ROLES:
+            raise ValueError
+    except (IndexError, ValueError):
+        await message.answer(
+            f"Использование: /remove_admin &lt;ID пользователя&gt; [роль]\n"
+            f"Роли: {', '.join(ADMIN_ROLES)}",
+            parse_mode='HTML'
+        )
+        return
+
+    # Владельцы из конфигурации все равно вернутся при следующем запуске
+    if user_id in current_shop.get().owner_ids and role in (None, 'owner'):
+        await message.answer("Владельца из конфигурации магазина снять нельзя.", parse_mode='HTML')
+        return
+
+    removed = remove_admin_role(user_id, role)
+    await message.answer(f"Снято ролей у пользователя {user_id}: {removed}.", parse_mode='HTML')
+    logger.info("Администратор %s снял у пользователя %s роль %s.", message.from_user.id, user_id, role or 'все')
+
+
+# Массовое изменение цен: /adjust_prices +10 [часть названия]
+@dp.message(Command("adjust_prices"), IsAdmin('catalog'))
+async def adjust_prices(message: types.Message, command: CommandObject):
+    args = (command.args or '').split(maxsplit=1)
+    try:
+        percent = float(args[0].replace(',', '.').rstrip('%'))
+        if not math.isfinite(percent) or percent <= -100:
+            raise ValueError
+    except (IndexError, ValueError):
+        await message.answer(
+            "Использование: /adjust_prices &lt;процент&gt; [часть названия]\n"
+            "Например: /adjust_prices +10 гауда",
+            parse_mode='HTML'
+        )
+        return
+
+    query = args[1].strip() if len(args) > 1 else None
+    updated, skipped = adjust_cheese_prices(percent, query)
+    text = f"Цены изменены на {percent:+g}% у {updated} сыров."
+    if skipped:
+        text += f"\nПропущено {skipped}: новая цена была бы нулевой."
+    await message.answer(text, parse_mode='HTML')
+    logger.info(
+        "Администратор %s изменил цены на %+g%% (запрос: %s), сыров: %s, пропущено: %s.",
+        message.from_user.id, percent, query, updated, skipped
+    )
 
-    await state.clear()
-    await message.answer("Данные сыра успешно обновлены!", parse_mode='HTML')
-    logger.info(f"Сыр с ID={cheese_id} успешно обновлен администратором {message.from_user.id}.")
 
 # Обработка пагинации удаления сыра (Вперед и Назад)
-@dp.callback_query(F.data.startswith("deleted_"), F.from_user.id == ADMIN_ID)
+@dp.callback_query(F.data.startswith("deleted_"), IsAdmin('catalog'))
 async def navigate_deletion_catalog(callback_query: types.CallbackQuery, state: FSMContext):
     try:
         action, current_page = callback_query.data.split('_')[1], int(callback_query.data.split('_')[2])
-        logger.debug(f"Навигация удаления каталога: действие={action}, текущая страница={current_page}")
+        logger.debug("Навигация удаления каталога: действие=%s, текущая страница=%s", action, current_page)
     except (IndexError, ValueError):
         await callback_query.answer("Некорректные данные пагинации удаления.", show_alert=True)
         logger.error("Некорректные данные пагинации удаления.")
@@ -715,15 +2560,15 @@ async def navigate_deletion_catalog(callback_query: types.CallbackQuery, state:
     await callback_query.message.edit_reply_markup(reply_markup=reply_markup)
 
     await callback_query.answer()
-    logger.info(f"Администратор {callback_query.from_user.id} перешел на страницу {new_page} удаления каталога.")
+    logger.info("Администратор %s перешел на страницу %s удаления каталога.", callback_query.from_user.id, new_page)
 
 
 # Обработка выбора сыра для удаления
-@dp.callback_query(F.data.startswith('delete_cheese_'), F.from_user.id == ADMIN_ID)
+@dp.callback_query(F.data.startswith('delete_cheese_'), IsAdmin('catalog'))
 async def choose_cheese_for_deletion(callback_query: types.CallbackQuery, state: FSMContext):
     try:
         cheese_id = int(callback_query.data.split('_')[2])
-        logger.debug(f"Администратор {callback_query.from_user.id} выбрал для удаления сыр с ID={cheese_id}.")
+        logger.debug("Администратор %s выбрал для удаления сыр с ID=%s.", callback_query.from_user.id, cheese_id)
     except (IndexError, ValueError):
         await callback_query.answer("Некорректный ID сыра для удаления.", show_alert=True)
         logger.error("Некорректный ID сыра для удаления.")
@@ -744,15 +2589,15 @@ async def choose_cheese_for_deletion(callback_query: types.CallbackQuery, state:
     )
 
     await callback_query.message.answer(
-        f"Вы уверены, что хотите удалить сыр <b>{cheese_name}</b>?",
+        f"Вы уверены, что хотите удалить сыр <b>{html.escape(cheese_name)}</b>?",
         reply_markup=builder.as_markup(),
         parse_mode='HTML'
     )
     await callback_query.answer()
-    logger.info(f"Администратор {callback_query.from_user.id} подтвердил удаление сыра ID={cheese_id}.")
+    logger.info("Администратор %s подтвердил удаление сыра ID=%s.", callback_query.from_user.id, cheese_id)
 
 # Обработка подтверждения удаления
-@dp.callback_query(F.data == "confirm_delete", StateFilter(DeleteCheeseForm.confirm), F.from_user.id == ADMIN_ID)
+@dp.callback_query(F.data == "confirm_delete", StateFilter(DeleteCheeseForm.confirm), IsAdmin('catalog'))
 async def confirm_delete(callback_query: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     cheese_id = data.get('cheese_id')
@@ -763,106 +2608,75 @@ async def confirm_delete(callback_query: types.CallbackQuery, state: FSMContext)
         await state.clear()
         return
 
-    # Удаление сыра из базы данных
-    conn = sqlite3.connect('cheese_shop.db')
+    # Мягкое удаление: сыр пропадает из каталога, но старые заказы продолжают на него ссылаться
+    conn = db_connect()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM cheeses WHERE id = ?", (cheese_id,))
+    cursor.execute(
+        "UPDATE cheeses SET deleted_at = CURRENT_TIMESTAMP WHERE id = ? AND deleted_at IS NULL",
+        (cheese_id,)
+    )
     conn.commit()
     conn.close()
+    invalidate_catalog()
 
-    await callback_query.message.answer(f"Сыр <b>{get_cheese_name(cheese_id)}</b> успешно удален.", parse_mode='HTML')
+    await callback_query.message.answer(f"Сыр <b>{html.escape(get_cheese_name(cheese_id))}</b> успешно удален.", parse_mode='HTML')
     await state.clear()
     await callback_query.answer()
-    logger.info(f"Администратор {callback_query.from_user.id} удалил сыр ID={cheese_id}.")
+    logger.info("Администратор %s удалил сыр ID=%s.", callback_query.from_user.id, cheese_id)
 
 # Обработка отмены удаления
-@dp.callback_query(F.data == "cancel_delete", StateFilter(DeleteCheeseForm.confirm), F.from_user.id == ADMIN_ID)
+@dp.callback_query(F.data == "cancel_delete", StateFilter(DeleteCheeseForm.confirm), IsAdmin('catalog'))
 async def cancel_delete(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.message.answer("Удаление сыра отменено.", parse_mode='HTML')
     await state.clear()
     await callback_query.answer()
-    logger.info(f"Администратор {callback_query.from_user.id} отменил удаление сыра.")
+    logger.info("Администратор %s отменил удаление сыра.", callback_query.from_user.id)
 
 
 
-# Обработка команды /skip для пропуска изменения фотографии
-@dp.message(StateFilter(EditCheeseForm.photo), F.from_user.id == ADMIN_ID, F.text.lower() == "/skip")
-async def skip_edit_cheese_photo(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    cheese_id = data.get('edit_cheese_id')
-    if not cheese_id:
-        await message.answer("Ошибка: ID сыра не найден.", parse_mode='HTML')
-        logger.error("ID сыра не найден в состоянии при пропуске изменения фото.")
-        await state.clear()
-        return
-
-    logger.debug(f"Администратор {message.from_user.id} решил не изменять фотографию сыра ID={cheese_id}.")
-
-    # Получение текущей фотографии сыра
-    conn = sqlite3.connect('cheese_shop.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT photo FROM cheeses WHERE id = ?", (cheese_id,))
-    result = cursor.fetchone()
-    conn.close()
-
-    if not result:
-        await message.answer("Сыр не найден.", parse_mode='HTML')
-        logger.warning(f"Сыр с ID={cheese_id} не найден при пропуске изменения фото.")
-        await state.clear()
-        return
-
-    photo_file_id = result[0]
-
-    # Обновление данных в базе данных без изменения фото
-    conn = sqlite3.connect('cheese_shop.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE cheeses SET name = ?, description = ?, price = ?, photo = ? WHERE id = ?",
-        (data['name'], data['description'], data['price'], photo_file_id, cheese_id)
-    )
-    conn.commit()
-    conn.close()
-
-    await state.clear()
-    await message.answer("Данные сыра успешно обновлены без изменения фотографии!", parse_mode='HTML')
-    logger.info(f"Сыр с ID={cheese_id} успешно обновлен без изменения фото администратором {message.from_user.id}.")
-
-
 # Обработка кнопок "О нас" и "Контакты"
 @dp.message(F.text == "О нас")
 async def about_us(message: types.Message):
     await message.answer("Мы предлагаем лучшие сыры от проверенных производителей!", parse_mode='HTML')
-    logger.info(f"Пользователь {message.from_user.id} запросил информацию 'О нас'.")
+    logger.info("Пользователь %s запросил информацию 'О нас'.", message.from_user.id)
 
 @dp.callback_query(F.data == "cancel_order")
 async def cancel_order(callback_query: types.CallbackQuery, state: FSMContext):
     await state.clear()  # Сбрасываем все состояния FSM
     await callback_query.message.answer("Ваш заказ был отменён.", reply_markup=types.ReplyKeyboardRemove())
     await callback_query.answer()
-    logger.info(f"Пользователь {callback_query.from_user.id} отменил заказ.")
+    logger.info("Пользователь %s отменил заказ.", callback_query.from_user.id)
 
 @dp.message(F.text == "Контакты")
 async def contacts(message: types.Message):
     await message.answer("Свяжитесь с нами:\nТелефон: +7 (XXX) XXX-XX-XX\nEmail: contact@cheese-shop.ru",
                          parse_mode='HTML')
-    logger.info(f"Пользователь {message.from_user.id} запросил информацию 'Контакты'.")
+    logger.info("Пользователь %s запросил информацию 'Контакты'.", message.from_user.id)
 
 async def list_cheeses_for_deletion(message: types.Message, state: FSMContext):
     await state.set_state(None)  # Убедимся, что нет активных состояний
     await message.answer("Выберите сыр для удаления:", reply_markup=deletion_pagination(), parse_mode='HTML')
-    logger.info(f"Администратор {message.from_user.id} начал процесс удаления сыра.")
-
-def get_all_orders():
-    conn = sqlite3.connect('cheese_shop.db')
+    logger.info("Администратор %s начал процесс удаления сыра.", message.from_user.id)
+
+# Заказы для администратора: keyset-пагинация по id (новые сверху), как в истории покупателя.
+# Возвращает (заказы, есть_еще)
+def get_all_orders(before_id=None, limit=ADMIN_ORDERS_PAGE_SIZE):
+    if before_id is None:
+        before_id = 2 ** 63 - 1
+    conn = db_connect()
     cursor = conn.cursor()
     cursor.execute('''
-    SELECT orders.id, orders.user_id, orders.telegram_username, cheeses.name, orders.name, orders.phone, orders.quantity, orders.address, orders.delivery_method, orders.timestamp
+    SELECT orders.id, orders.user_id, orders.telegram_username, cheeses.name, orders.name, orders.phone, orders.quantity, orders.address, orders.delivery_method, orders.timestamp, orders.status
     FROM orders
-    JOIN cheeses ON orders.cheese_id = cheeses.id
-    ORDER BY orders.timestamp DESC
-    ''')
+    LEFT JOIN cheeses ON orders.cheese_id = cheeses.id
+    WHERE orders.id < ?
+    ORDER BY orders.id DESC
+    LIMIT ?
+    ''', (before_id, limit + 1))  # Запрашиваем на одну запись больше, чтобы узнать о следующей странице
     orders = cursor.fetchall()
     conn.close()
+    has_more = len(orders) > limit
+    orders = orders[:limit]
 
     # Преобразуем результат в список словарей для удобства
     orders_list = []
@@ -872,57 +2686,232 @@ def get_all_orders():
             'user_id': order[1],
             'telegram_username': order[2],
             'cheese_name': order[3],
-            'customer_name': order[4],
+            'name': order[4],
             'phone': order[5],
             'quantity': order[6],
             'address': order[7],
             'delivery_method': order[8],
-            'timestamp': order[9]
+            'timestamp': order[9],
+            'status': order[10]
         })
-    return orders_list
+    return orders_list, has_more
 
 
-def save_order(user_id, telegram_username, cheese_id, name, phone, quantity, delivery_method, address=None):
-    conn = sqlite3.connect('cheese_shop.db')
+def save_order(user_id, telegram_username, cheese_id, name, phone, quantity, delivery_method, address=None, locale=None):
+    conn = db_connect()
+    cursor = conn.cursor()
+    # При занятой базе sqlite3.OperationalError уходит вызывающему: данные заказа остаются в анкете,
+    # а соединение возвращается в пул с откатом
+    try:
+        cursor.execute(
+            '''
+            INSERT INTO orders (user_id, telegram_username, cheese_id, name, phone, quantity, delivery_method, address, locale)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            (user_id, telegram_username, cheese_id, name, phone, quantity, delivery_method, address, locale)
+        )
+        conn.commit()
+        order_id = cursor.lastrowid
+    finally:
+        conn.close()
+    invalidate_user_orders(user_id)
+    current_shop.get().recommender.add_order(user_id, cheese_id)
+    logger.info("Заказ сохранён: Пользователь ID=%s, Ник=%s, Сыр ID=%s, Количество=%sг, Способ получения=%s, Адрес=%s", user_id, Redacted(telegram_username), cheese_id, quantity, delivery_method, Redacted(address))
+    return order_id
+
+async def notify_admin(order_data):
+    shop = current_shop.get()
+    message = render(
+        shop.locale, 'order_new',
+        **order_fields(shop.locale, order_data),
+        cheese_name=get_cheese_name(order_data['cheese_id']),
+    )
+
+    # Всем обработчикам заказов сразу, а не по очереди; число одновременных отправок
+    # ограничено общим для магазина семафором
+    await asyncio.gather(*(
+        send_admin_notification(shop, admin_id, message, order_data['order_id'])
+        for admin_id in shop.admins_with_role('orders')
+    ))
+
+
+async def send_admin_notification(shop, admin_id, message, order_id):
+    async with shop.send_limiter:
+        try:
+            sent = await shop.bot.send_message(
+                admin_id, message,
+                reply_markup=order_status_keyboard(order_id, 'new'),
+                parse_mode='HTML'
+            )
+            save_order_notification(order_id, admin_id, sent.message_id)
+            logger.info("Уведомление о новом заказе отправлено администратору (ID: %s).", admin_id)
+        except Exception as e:
+            logger.error("Ошибка при отправке уведомления администратору %s: %s", admin_id, e)
+
+def save_order_notification(order_id, chat_id, message_id):
+    conn = db_connect()
     cursor = conn.cursor()
     cursor.execute(
-        '''
-        INSERT INTO orders (user_id, telegram_username, cheese_id, name, phone, quantity, delivery_method, address)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''',
-        (user_id, telegram_username, cheese_id, name, phone, quantity, delivery_method, address)
+        "INSERT OR REPLACE INTO order_notifications (order_id, chat_id, message_id) VALUES (?, ?, ?)",
+        (order_id, chat_id, message_id)
     )
     conn.commit()
     conn.close()
-    logger.info(f"Заказ сохранён: Пользователь ID={user_id}, Ник={telegram_username}, Сыр ID={cheese_id}, Количество={quantity}г, Способ получения={delivery_method}, Адрес={address}")
 
-async def notify_admin(order_data):
-    telegram_username = f"@{order_data['telegram_username']}" if order_data['telegram_username'] else "Не указан"
-    message = (
-        f"🆕 Новый заказ!\n\n"
-        f"Имя: {order_data['name']}\n"
-        f"Telegram: {telegram_username}\n"
-        f"Телефон: {order_data['phone']}\n"
-        f"Количество: {order_data['quantity']} грамм\n"
-        f"Способ получения: {order_data['delivery_method']}\n"
-        f"Адрес: {order_data.get('address', 'Самовывоз')}\n\n"
-        f"🧀 Заказанный сыр: {get_cheese_name(order_data['cheese_id'])}"
+
+def get_order_notifications(order_id):
+    conn = db_connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT chat_id, message_id FROM order_notifications WHERE order_id = ?", (order_id,))
+    notifications = cursor.fetchall()
+    conn.close()
+    return notifications
+
+
+# Отмечает новый статус под уведомлениями о заказе у остальных администраторов,
+# чтобы никто не нажимал кнопки по устаревшему состоянию
+async def refresh_order_notifications(shop, order_id, status, skip_chat_id):
+    keyboard = order_status_keyboard(order_id, status)
+    for chat_id, message_id in get_order_notifications(order_id):
+        if chat_id == skip_chat_id:
+            continue
+        async with shop.send_limiter:
+            try:
+                await shop.bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=keyboard)
+            except Exception as e:
+                logger.warning("Не удалось обновить кнопки заказа ID=%s у администратора %s: %s", order_id, chat_id, e)
+
+
+# Кнопки смены статуса под уведомлением о заказе; текущий статус отмечен точкой
+def order_status_keyboard(order_id, current_status):
+    builder = InlineKeyboardBuilder()
+    for status, label in ORDER_STATUSES.items():
+        if status == 'new':
+            continue
+        text = f"• {label}" if status == current_status else label
+        builder.add(InlineKeyboardButton(text=text, callback_data=f"ostatus_{status}_{order_id}"))
+    builder.adjust(3)
+    return builder.as_markup()
+
+
+# Смена статуса заказа, в том числе уже перенесенного в архив.
+# Возвращает (user_id, прежний статус, язык покупателя) или None, если заказа нет
+def set_order_status(order_id, status):
+    conn = db_connect()
+    cursor = conn.cursor()
+    for table in ('orders', 'orders_archive'):
+        cursor.execute(f"SELECT user_id, status, locale FROM {table} WHERE id = ?", (order_id,))
+        row = cursor.fetchone()
+        if row:
+            break
+    else:
+        conn.close()
+        return None
+
+    user_id, previous_status, locale = row
+    if previous_status != status:
+        cursor.execute(f"UPDATE {table} SET status = ? WHERE id = ?", (status, order_id))
+        conn.commit()
+        invalidate_user_orders(user_id)
+    conn.close()
+    return user_id, previous_status, locale or DEFAULT_LOCALE
+
+
+# История заказов пользователя: keyset-пагинация по id (новые сверху), включая архив.
+# Страницы кэшируются в магазине, вытеснение LRU по пользователям
+def get_user_orders(user_id, before_id=None, limit=MY_ORDERS_PAGE_SIZE):
+    my_orders_cache = current_shop.get().my_orders_cache
+    cache_key = before_id
+    user_cache = my_orders_cache.get(user_id)
+    if user_cache is not None and cache_key in user_cache:
+        my_orders_cache.move_to_end(user_id)
+        return user_cache[cache_key]
+
+    if before_id is None:
+        before_id = 2 ** 63 - 1
+    conn = db_connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT o.id, cheeses.name, o.quantity, o.delivery_method, o.status, o.timestamp
+    FROM (
+        SELECT * FROM (
+            SELECT id, cheese_id, quantity, delivery_method, status, timestamp FROM orders
+            WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT id, cheese_id, quantity, delivery_method, status, timestamp FROM orders_archive
+            WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+        )
+    ) AS o
+    LEFT JOIN cheeses ON o.cheese_id = cheeses.id
+    ORDER BY o.id DESC
+    LIMIT ?
+    ''', (user_id, before_id, limit + 1, user_id, before_id, limit + 1, limit + 1))
+    orders = cursor.fetchall()
+    conn.close()
+
+    page = (orders[:limit], len(orders) > limit)
+    my_orders_cache.setdefault(user_id, {})[cache_key] = page
+    my_orders_cache.move_to_end(user_id)
+    if len(my_orders_cache) > MY_ORDERS_CACHE_USERS:
+        my_orders_cache.popitem(last=False)
+    return page
+
+
+def invalidate_user_orders(user_id):
+    current_shop.get().my_orders_cache.pop(user_id, None)
+
+
+# Название удаленного из базы сыра приходит как None и заменяется подписью на языке пользователя
+def format_user_orders(locale, orders):
+    unknown_cheese = message_text(locale, 'unknown_cheese')
+    return "\n\n".join(
+        render(
+            locale, 'order_history_item',
+            order_id=order_id,
+            timestamp=timestamp,
+            cheese_name=cheese_name if cheese_name is not None else unknown_cheese,
+            quantity=quantity,
+            delivery_method=delivery_method_label(locale, delivery_method),
+            status=status_label(locale, status),
+        )
+        for order_id, cheese_name, quantity, delivery_method, status, timestamp in orders
     )
 
-    try:
-        await bot.send_message(ADMIN_ID, message, parse_mode='HTML')
-        logger.info(f"Уведомление о новом заказе отправлено администратору (ID: {ADMIN_ID}).")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления администратору: {e}")
+
+def all_orders_keyboard(orders, has_more):
+    if not has_more:
+        return None
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="Ранее ➡️", callback_data=f"allorders_{orders[-1]['id']}"))
+    return builder.as_markup()
+
+
+def my_orders_keyboard(orders, has_more):
+    if not has_more:
+        return None
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="Ранее ➡️", callback_data=f"myorders_{orders[-1][0]}"))
+    return builder.as_markup()
+
 
 def get_cheese_name(cheese_id):
-    conn = sqlite3.connect('cheese_shop.db')
+    conn = db_connect()
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM cheeses WHERE id = ?", (cheese_id,))
     result = cursor.fetchone()
     conn.close()
     return result[0] if result else "Неизвестный сыр"
 
+def cheese_available(cheese_id):
+    conn = db_connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM cheeses WHERE id = ? AND deleted_at IS NULL", (cheese_id,))
+    result = cursor.fetchone()
+    conn.close()
+    return result is not None
+
 # Функция для получения сыров с пагинацией для удаления
 def get_cheeses_for_deletion(offset=0, limit=10):
     return get_cheeses(offset=offset, limit=limit)
@@ -954,18 +2943,221 @@ def deletion_pagination(page=0, limit=10):
 
     return builder.as_markup()
 
+# Пагинация для редактирования сыра (с учетом поискового запроса)
+def edit_pagination(page=0, limit=10, query=None):
+    builder = InlineKeyboardBuilder()
+    offset = page * limit
+    cheeses = get_cheeses(offset=offset, limit=limit + 1, query=query)  # Запрашиваем на одну запись больше
+
+    has_next = False
+    if len(cheeses) > limit:
+        has_next = True
+        cheeses = cheeses[:limit]  # Обрезаем лишнюю запись
+
+    for cheese in cheeses:
+        builder.add(InlineKeyboardButton(text=cheese[1], callback_data=f"edit_cheese_{cheese[0]}"))
+
+    builder.adjust(2)  # Размещаем по 2 кнопки в строку
+
+    navigation_buttons = []
+    if page > 0:
+        navigation_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"editpage_{page-1}"))
+    if has_next:
+        navigation_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"editpage_{page+1}"))
+
+    if navigation_buttons:
+        builder.row(*navigation_buttons)  # Навигационные кнопки на отдельной строке
+
+    builder.row(InlineKeyboardButton(text="🔍 Поиск", callback_data="edit_search"))
+    return builder.as_markup()
+
+
+def edit_search_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="🔍 Поиск", callback_data="edit_search"))
+    return builder.as_markup()
+
+
+# Клавиатура выбора поля для редактирования
+def edit_fields_keyboard(cheese_id):
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="Название", callback_data=f"edit_field_name_{cheese_id}"),
+        InlineKeyboardButton(text="Описание", callback_data=f"edit_field_description_{cheese_id}")
+    )
+    builder.row(
+        InlineKeyboardButton(text="Цена", callback_data=f"edit_field_price_{cheese_id}"),
+        InlineKeyboardButton(text="Фото", callback_data=f"edit_field_photo_{cheese_id}")
+    )
+    return builder.as_markup()
+
+
+# Точечное обновление одного поля сыра
+def update_cheese_field(cheese_id, field, value):
+    if field not in EDIT_FIELD_PROMPTS:
+        raise ValueError(f"Недопустимое поле сыра: {field}")
+
+    conn = db_connect()
+    cursor = conn.cursor()
+    # Имя колонки берется только из белого списка EDIT_FIELD_PROMPTS
+    cursor.execute(f"UPDATE cheeses SET {field} = ? WHERE id = ? AND deleted_at IS NULL", (value, cheese_id))
+    conn.commit()
+    updated = cursor.rowcount
+    conn.close()
+    if field == 'name':
+        invalidate_catalog()  # В кэше каталога хранятся только названия
+    return updated > 0
+
+
+# Изменение цен на процент одним запросом, с необязательным фильтром по названию
+def adjust_cheese_prices(percent, query=None):
+    """Меняет цены на percent процентов; возвращает (изменено, пропущено). Цена не может стать нулевой."""
+    factor = 1 + percent / 100
+    condition = "deleted_at IS NULL"
+    params = ()
+    if query:
+        condition += " AND instr(casefold(name), ?) > 0"
+        params = (query.casefold(),)
+    conn = db_connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"UPDATE cheeses SET price = ROUND(price * ?, 2) WHERE {condition} AND ROUND(price * ?, 2) > 0",
+        (factor, *params, factor)
+    )
+    updated = cursor.rowcount
+    cursor.execute(f"SELECT COUNT(*) FROM cheeses WHERE {condition} AND ROUND(price * ?, 2) <= 0", (*params, factor))
+    skipped = cursor.fetchone()[0]
+    conn.commit()
+    conn.close()
+    return updated, skipped
+
 def cancel_order_keyboard():
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="Отменить заказ", callback_data="cancel_order"))
     return builder.as_markup()
 
+# Быстрый запуск. До начала опроса выполняется только то, без чего нельзя ответить: схема БД,
+# администраторы и таймеры. Пересчет рекомендаций и прогрев кэша каталога идут в фоне после первого
+# ответа; до тех пор карточки сыров показываются без рекомендаций, а «Популярное» — по порядку id
+startup_report = {'import_s': None, 'ready_s': None, 'first_response_s': None, 'warmup_s': None}
+first_response = asyncio.Event()
+startup_tasks = set()  # прогрев; при остановке отменяется, а не дожидается
+
+
+def since_start():
+    return round(time.monotonic() - STARTED_AT, 3)
+
+
+async def warm_up():
+    try:
+        await asyncio.wait_for(first_response.wait(), timeout=WARMUP_DELAY)
+    except asyncio.TimeoutError:
+        pass
+
+    started = time.perf_counter()
+    for shop in SHOPS.values():
+        with shop_context(shop):
+            try:
+                await rebuild_recommendations()
+                catalog_pagination()
+            except Exception as e:
+                logger.error("Ошибка прогрева магазина %s: %s", shop.name, e)
+    startup_report['warmup_s'] = round(time.perf_counter() - started, 3)
+    logger.info("Прогрев завершен за %.2f с.", startup_report['warmup_s'])
+
+
+# Плавная остановка. По SIGTERM/SIGINT aiogram прекращает опрос и вызывает обработчики shutdown, пока
+# сессия ботов еще открыта. Дожидаемся апдейтов в обработке, фоновых рассылок и сработавших таймеров,
+# сохраняем таймеры и подтверждаем смещение, чтобы после перезапуска Telegram не прислал их повторно
+@dp.shutdown()
+async def drain():
+    started = time.monotonic()
+    deadline = started + SHUTDOWN_TIMEOUT
+    logger.info(
+        "Остановка: опрос прекращен, апдейтов в обработке: %s.",
+        sum(len(shop.inflight) for shop in SHOPS.values())
+    )
+    for task in startup_tasks:
+        task.cancel()
+
+    # Апдейты порождают фоновые рассылки и таймеры, поэтому ждем, пока не останется никакой работы
+    while True:
+        tasks = {
+            task
+            for shop in SHOPS.values()
+            for task in (*shop.inflight, *shop.background_tasks, *shop.scheduler._running)
+        }
+        timeout = deadline - time.monotonic()
+        if not tasks or timeout <= 0:
+            break
+        await asyncio.wait(tasks, timeout=timeout)
+
+    if tasks:
+        lost = sorted(update_id for shop in SHOPS.values() for update_id in shop.inflight.values())
+        logger.warning(
+            "За %s с не завершено задач: %s, прерываем (апдейты: %s).", SHUTDOWN_TIMEOUT, len(tasks), lost
+        )
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for shop in SHOPS.values():
+        if shop.scheduler_task is not None:
+            shop.scheduler_task.cancel()  # run() сохраняет несохраненные таймеры при выходе
+    await asyncio.gather(
+        *(shop.scheduler_task for shop in SHOPS.values() if shop.scheduler_task is not None),
+        return_exceptions=True
+    )
+
+    for shop in SHOPS.values():
+        if shop.last_update_id is None:
+            continue
+        try:
+            await shop.bot.get_updates(offset=shop.last_update_id + 1, limit=1, timeout=0)
+        except Exception as e:
+            logger.error("Не удалось подтвердить смещение апдейтов магазина %s: %s", shop.name, e)
+    logger.info(
+        "Остановка завершена за %.2f с.", time.monotonic() - started, extra={'startup': dict(startup_report)}
+    )
+
+
 # Главная функция для запуска бота
 async def main():
-    setup_db()
-    logger.info("Запуск бота...")
-    await dp.start_polling(bot)
+    # Одна HTTP-сессия на все боты: общий пул соединений с Bot API
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else PRODUCTION)
+    session.middleware(count_api_calls)
+    for config in load_shop_configs():
+        register_shop(config, session)
+
+    for shop in SHOPS.values():
+        with shop_context(shop):
+            setup_db()
+            load_admins()
+            shop.scheduler.load()
+            schedule_periodic_jobs()
+            shop.scheduler_task = asyncio.create_task(shop.scheduler.run())
+    startup_tasks.add(asyncio.create_task(warm_up()))
+
+    watchdog.start()
+    if HEALTH_PORT:
+        await start_health_server()
+    startup_report['ready_s'] = since_start()
+    logger.info(
+        "Запуск ботов: %s (импорт %.2f с, готовность через %.2f с после запуска процесса)...",
+        ', '.join(shop.name for shop in SHOPS.values()), startup_report['import_s'], startup_report['ready_s']
+    )
+    try:
+        await dp.start_polling(*(shop.bot for shop in SHOPS.values()))
+    finally:
+        db_pool.close_all()
+
+
+startup_report['import_s'] = since_start()
 
 
 # Запуск бота
 if __name__ == '__main__':
-    asyncio.run(main())
+    if sys.argv[1:] == ['--vacuum']:
+        enable_incremental_vacuum()
+    else:
+        asyncio.run(main())
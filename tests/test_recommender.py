@@ -0,0 +1,57 @@
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Recommender  # noqa: E402
+
+
+def replay(orders):
+    recommender = Recommender()
+    for user_id, cheese_id in orders:
+        recommender.add_order(user_id, cheese_id)
+    return recommender
+
+
+def assert_equivalent(incremental, bulk):
+    size = len(bulk.index)
+    assert len(incremental.index) == size
+    # Номера строк зависят от порядка появления сыров, сравниваем в пространстве cheese_id
+    order = [incremental.index[int(cheese_id)] for cheese_id in bulk.cheese_ids[:size]]
+    assert np.array_equal(incremental.popularity[order], bulk.popularity[:size])
+    assert np.array_equal(incremental.cooccurrence[np.ix_(order, order)], bulk.cooccurrence[:size, :size])
+    assert incremental.top == bulk.top
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_incremental_matches_rebuild(seed):
+    rng = random.Random(seed)
+    orders = [(rng.randrange(60), rng.randrange(1, 31)) for _ in range(2000)]
+
+    bulk = Recommender()
+    bulk.rebuild(orders)
+    assert_equivalent(replay(orders), bulk)
+
+
+def test_popularity_breaks_ties_after_repeat_order():
+    # Сыры 2 и 3 куплены вместе с сыром 1 одинаково часто; повторный заказ сыра 3 тем же
+    # покупателем не меняет матрицу, но должен поднять его в списке сыра 1
+    orders = [(1, 1), (1, 2), (2, 1), (2, 3), (2, 3)]
+    recommender = replay(orders)
+    assert recommender.recommend(1) == [3, 2]
+
+    bulk = Recommender()
+    bulk.rebuild(orders)
+    assert bulk.recommend(1) == [3, 2]
+
+
+def test_top_n_cut_keeps_most_popular_of_tied():
+    recommender = Recommender(top_n=1)
+    orders = [(1, 1), (1, 2), (2, 1), (2, 3), (3, 3)]
+    for user_id, cheese_id in orders:
+        recommender.add_order(user_id, cheese_id)
+    assert recommender.recommend(1) == [3]